@@ -0,0 +1,276 @@
+# benchmark.py
+#
+# version 0.1
+
+"""\
+prime、r0rs、cal24、combinatorics四个模块热点路径的性能基准。
+
+每个基准由一个准备函数登记，准备函数返回要计时的无参函数（准备工作不计时）。计时用timeit，循环次数自动选取，
+重复若干次取最好和中位数；内存基准不计时，用tracemalloc测一次调用的峰值和调用返回后结果仍占用的内存（字节）。
+结果写成JSON；比较两份结果时，时间或内存峰值增加超过阈值的标为回退，命令以状态1退出：
+
+    python benchmark.py -o base.json                    # 运行全部基准
+    python benchmark.py -k prime. -o new.json           # 只运行名字包含prime.的
+    python benchmark.py --compare base.json new.json    # 比较两份结果
+    python benchmark.py -o new.json --compare base.json # 运行后直接与base.json比较
+
+>>> base = {'results' : {'a' : {'best' : 1.0}, 'b' : {'best' : 1.0}, 'c' : {'best' : 1.0}}}
+>>> new = {'results' : {'a' : {'best' : 1.5}, 'b' : {'best' : 0.5}, 'd' : {'best' : 1.0}}}
+>>> compare(base, new, 0.1)
+[('a', 1.0, 1.5, 1.5, 'REGRESSION'), ('b', 1.0, 0.5, 0.5, 'faster')]
+>>> compare({'results' : {'m' : {'peak' : 1000}}}, {'results' : {'m' : {'peak' : 2000}}})
+[('m', 1000, 2000, 2.0, 'REGRESSION')]
+"""
+
+import io
+import os
+import re
+import sys
+import json
+import time
+import timeit
+import tracemalloc
+import platform
+import statistics
+import contextlib
+
+import prime
+import r0rs
+import cal24
+import combinatorics
+
+BENCHES = {}            # 名字 -> 准备函数
+MEMORY = set()          # 测内存而不计时的基准的名字
+
+def bench(name, memory=False) :
+    def register(setup) :
+        BENCHES[name] = setup
+        if memory :
+            MEMORY.add(name)
+        return setup
+    return register
+
+# --- prime -----------------------------------------------------------------
+SMALL = range(1, 20000)
+PRIMES64 = [ 2**61-1, 2**64-59, 999999999989, 18446744073709551557 ]
+COMPOSITES64 = [ (2**32-5)*(2**31-1), 1000000007*998244353, 3825123056546413051 ]
+BIGINTS = [ 2**521-1, 2**607-1, 10**300+1 ]
+
+@bench('prime.is_prime.small')
+def _() :
+    return lambda : [ prime.is_prime(n) for n in SMALL ]
+
+@bench('prime.is_prime.64bit')
+def _() :
+    return lambda : prime.is_prime(999999999989)
+
+@bench('prime.is_primeM.small')
+def _() :
+    return lambda : [ prime.is_primeM(n) for n in SMALL ]
+
+@bench('prime.is_primeM.64bit')
+def _() :
+    return lambda : [ prime.is_primeM(n) for n in PRIMES64 + COMPOSITES64 ]
+
+@bench('prime.is_primeM.bigint')
+def _() :
+    return lambda : [ prime.is_primeM(n) for n in BIGINTS ]
+
+@bench('prime.factorize.small')
+def _() :
+    return lambda : [ prime.factorize(n) for n in range(2, 5000) ]
+
+@bench('prime.factorize.64bit')
+def _() :
+    return lambda : [ prime.factorize(n) for n in (1000000007*998244353, 2**64+1, 600851475143) ]
+
+@bench('prime.factorize.bigint')
+def _() :
+    return lambda : prime.factorize((2**127-1)*274177*1000003)
+
+@bench('prime.powermod.small')
+def _() :
+    return lambda : [ prime.powermod(3, n-1, n) for n in range(3, 20000, 2) ]
+
+@bench('prime.powermod.64bit')
+def _() :
+    return lambda : [ prime.powermod(3, n-1, n) for n in PRIMES64 ]
+
+@bench('prime.powermod.bigint')
+def _() :
+    return lambda : [ prime.powermod(3, n-1, n) for n in BIGINTS ]
+
+@bench('prime.prime_pi')
+def _() :
+    return lambda : prime.prime_pi(10**9)
+
+@bench('prime.nth_prime')
+def _() :
+    return lambda : prime.nth_prime(10**7)
+
+# --- r0rs ------------------------------------------------------------------
+FIB = '(define (fib n) (cond ((< n 2) n) (else (+ (fib (- n 1)) (fib (- n 2)))))) (fib 18)'
+SUM = '(define (sum n) (cond ((= n 0) 0) (else (+ n (sum (- n 1)))))) (sum 20000)'
+
+def _r0(source) :
+    exprs = r0rs.SxParser.fromString(source)
+    return lambda : r0rs.Interp0().evals(exprs)
+
+@bench('r0rs.example')
+def _() :
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'example.ss'), encoding='utf-8') as f :
+        source = f.read()
+    return lambda : r0rs.Interp0().evals(r0rs.SxParser.fromString(source))
+
+@bench('r0rs.fib')
+def _() :
+    return _r0(FIB)
+
+@bench('r0rs.deep_recursion')
+def _() :
+    return _r0(SUM)
+
+@bench('r0rs.parse')
+def _() :
+    source = '\n'.join( '(define (f%d x y) (cond ((< x y) (+ x (* y %d))) (else (list x y "s%d" 1.5))))' % (i, i, i) for i in range(2000) )
+    return lambda : r0rs.SxParser.fromString(source)
+
+BUILD = '(define (build n acc) (if (= n 0) acc (build (- n 1) (cons (* n 3) acc)))) (build %d ())'
+
+@bench('r0rs.memory.parse_list', memory=True)
+def _() :
+    source = '(list %s)' % ' '.join( str(i % 1000) for i in range(200000) )
+    return lambda : r0rs.SxParser.fromString(source)
+
+@bench('r0rs.memory.build_list', memory=True)
+def _() :
+    return _r0(BUILD % 50000)
+
+@bench('r0rs.memory.append_list', memory=True)
+def _() :
+    return _r0('(define (build n acc) (if (= n 0) acc (build (- n 1) (append (list n (+ n 0.5)) acc)))) (build 20000 ())')
+
+@bench('r0rs.build_list')
+def _() :
+    return _r0(BUILD % 20000)
+
+# --- cal24 -----------------------------------------------------------------
+def _cal24_fresh() :
+    """清空求解器的记忆，每次计时都从头算。"""
+    cal24.values.cache_clear()
+    cal24._exprs.cache_clear()
+
+@bench('cal24.cal24')
+def _() :
+    quads = [ (1, 2, 3, 4), (4, 4, 10, 10), (1, 5, 5, 5), (3, 3, 8, 8), (6, 7, 8, 9) ]
+    def run() :
+        _cal24_fresh()
+        return [ list(cal24.cal24(q)) for q in quads ]
+    return run
+
+@bench('cal24.cal_all')
+def _() :
+    def run() :
+        _cal24_fresh()
+        with contextlib.redirect_stdout(io.StringIO()) :
+            cal24.cal_all(1, 6, table=cal24.sweep(1, 6, workers=1))
+    return run
+
+# --- combinatorics ---------------------------------------------------------
+ALLOC_CASES = [ ('small', '111123478', (2, 2, 2, 3)), ('medium', '1111223344556', (3, 3, 3, 4)), ('large', 'abcdefghij', (2, 2, 2, 2, 2)) ]
+
+def _drain(it) :
+    for x in it :
+        pass
+
+for size, seq, grp in ALLOC_CASES :
+    bench('combinatorics.allocations.' + size)( lambda seq=seq, grp=grp : lambda : _drain(combinatorics.allocations(seq, grp)) )
+    bench('combinatorics.groups.' + size)( lambda seq=seq, grp=grp : lambda : _drain(combinatorics.groups(seq, grp)) )
+for size, n in (('small', 20), ('medium', 30), ('large', 36)) :
+    bench('combinatorics.partitions.' + size)( lambda n=n : lambda : _drain(combinatorics.partitions(n)) )
+
+if combinatorics.np is not None :
+    for size, seq, grp in ALLOC_CASES :
+        bench('combinatorics.allocation_arrays.' + size)( lambda seq=seq, grp=grp : lambda : _drain(combinatorics.allocation_arrays(seq, grp)) )
+    bench('combinatorics.permutation_arrays')( lambda : lambda : _drain(combinatorics.permutation_arrays('aabbccddee', 10)) )
+
+# --- 运行与比较 ------------------------------------------------------------
+
+def measure(fn, repeat=5) :
+    """自动选取循环次数使一轮不少于0.2秒，重复repeat轮，返回每次调用的最好和中位时间（秒）。"""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    times = [ t/number for t in timer.repeat(repeat, number) ]
+    return {'best' : min(times), 'median' : statistics.median(times), 'number' : number, 'repeat' : repeat}
+
+def measure_memory(fn) :
+    """先调用一次（载入时的缓存等不计入），再在tracemalloc下调用一次，返回峰值和结果仍占用的内存（字节）。"""
+    fn()
+    tracemalloc.start()
+    try :
+        result = fn()
+        kept, peak = tracemalloc.get_traced_memory()
+    finally :
+        tracemalloc.stop()
+    del result
+    return {'peak' : peak, 'kept' : kept}
+
+def run(pattern='', repeat=5, out=sys.stderr) :
+    results = {}
+    for name, setup in BENCHES.items() :
+        if re.search(pattern, name) :
+            if name in MEMORY :
+                results[name] = res = measure_memory(setup())
+                print('%-40s %10.1f KB peak, %.1f KB kept' % (name, res['peak']/1024, res['kept']/1024), file=out)
+            else :
+                results[name] = res = measure(setup(), repeat)
+                print('%-40s %12.6f s  (x%d)' % (name, res['best'], res['number']), file=out)
+    return {'meta' : {'python' : platform.python_version(), 'platform' : platform.platform(),
+                      'time' : time.strftime('%Y-%m-%d %H:%M:%S')}, 'results' : results}
+
+def compare(base, new, threshold=0.1) :
+    """两份结果中都有的基准，按最好时间（内存基准按峰值）比较：[(名字, 原值, 新值, 比值, 标记), ...]，只列出变化超过阈值的。"""
+    rows = []
+    for name in sorted(set(base['results']) & set(new['results'])) :
+        key = 'best' if 'best' in base['results'][name] else 'peak'
+        b, n = base['results'][name][key], new['results'][name][key]
+        ratio = n/b
+        if ratio > 1+threshold :
+            rows.append( (name, b, n, round(ratio, 3), 'REGRESSION') )
+        elif ratio < 1/(1+threshold) :
+            rows.append( (name, b, n, round(ratio, 3), 'faster') )
+    return rows
+
+def load(path) :
+    with open(path, encoding='utf-8') as f :
+        return json.load(f)
+
+if __name__ == '__main__' :
+    import argparse
+    parser = argparse.ArgumentParser(description = '运行性能基准，或比较两次的结果。')
+    parser.add_argument('-k', metavar='PATTERN', default='', help='只运行名字与正则表达式PATTERN匹配的基准。')
+    parser.add_argument('-o', '--output', metavar='FILE', help='结果写入JSON文件。')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='每个基准重复的轮数，缺省为5。')
+    parser.add_argument('-l', '--list', action='store_true', help='列出所有基准的名字。')
+    parser.add_argument('--compare', metavar='FILE', nargs='+', help='与FILE比较；给出两个文件时只比较它们，不运行基准。')
+    parser.add_argument('--threshold', type=float, default=0.1, help='变慢超过这个比例算回退，缺省为0.1。')
+    args = parser.parse_args()
+
+    if args.list :
+        print(*BENCHES, sep='\n')
+        sys.exit()
+    if args.compare and len(args.compare) == 2 :
+        base, new = load(args.compare[0]), load(args.compare[1])
+    else :
+        new = run(args.k, args.repeat)
+        if args.output :
+            with open(args.output, 'w', encoding='utf-8') as f :
+                json.dump(new, f, indent=1)
+        base = load(args.compare[0]) if args.compare else None
+    if base is not None :
+        rows = compare(base, new, args.threshold)
+        for row in rows :
+            print('%-40s %12.6f -> %12.6f  x%.3f  %s' % row)
+        if not rows :
+            print('no change beyond %.0f%%' % (args.threshold*100))
+        sys.exit(1 if any( row[-1] == 'REGRESSION' for row in rows ) else 0)
@@ -4,9 +4,20 @@
 
 """\
 算24点游戏。对任意四个整数，列出所有结果为24的表达式。
+
+求解时把数的多重集拆成两个子集，子集能算出的值各自记忆，两两组合；只有算中目标的组合才回溯出表达式。
+表达式按加法、乘法的交换律和结合律化成标准形式，写法不同而实质相同的只列一个。目标和数的个数都可以任意：
+
+>>> list(cal24( (4, 4, 10, 10) ))
+['(10*10-4)/4']
+>>> list(cal24( (1, 5, 5, 5) ))
+['(5-1/5)*5']
+>>> list(cal24( (2, 3, 4), 10 ))
+['2*3+4', '3*4-2']
 """
 
 from fractions import Fraction
+from functools import lru_cache
 import itertools
 
 def expr_RPN(e) :
@@ -39,55 +50,200 @@ def expr_RPN(e) :
             st.append( (Fraction(i), str(i)) )
     return st.pop()
 
-def cal24(n4) :
-    """输入4个整数，列出(generator)满足条件的表达式。
+# --- 子集组合求解 -------------------------------------------------------
+# 多重集用排好序的整数元组表示，作为记忆的键。
+
+def _splits(ms) :
+    """把多重集ms拆成两个非空子多重集(a, b)，不计顺序，每种拆法只产出一次。"""
+    seen = set()
+    for k in range(1, len(ms)//2+1) :
+        for idx in itertools.combinations(range(len(ms)), k) :
+            a = tuple( ms[i] for i in idx )
+            b = tuple( ms[i] for i in range(len(ms)) if i not in idx )
+            if k*2 == len(ms) and b < a :
+                a, b = b, a
+            if (a, b) not in seen :
+                seen.add( (a, b) )
+                yield a, b
+
+@lru_cache(maxsize=None)
+def values(ms) :
+    """多重集ms的数全部用上，四则运算能得到的所有值（Fraction的frozenset）。"""
+    if len(ms) == 1 :
+        return frozenset( (Fraction(ms[0]),) )
+    res = set()
+    for a, b in _splits(ms) :
+        vb = values(b)
+        for x in values(a) :
+            for y in vb :
+                res.update( (x+y, x-y, y-x, x*y) )
+                if y : res.add(x/y)
+                if x : res.add(y/x)
+    return frozenset(res)
+
+# 表达式的标准形式：数是('n', 值)，和是('+', 正项, 负项)，积是('*', 分子因子, 分母因子)，各项排好序。
+# 和的项不再是和，积的因子不再是积，于是交换、结合得到的各种写法化成同一个形式。
+
+def _terms(e) :
+    return (e[1], e[2]) if e[0] == '+' else ((e,), ())
+def _factors(e) :
+    return (e[1], e[2]) if e[0] == '*' else ((e,), ())
+
+def _combine(op, x, y) :
+    if op == '+' or op == '-' :
+        (p1, n1), (p2, n2) = _terms(x), _terms(y)
+        if op == '-' : p2, n2 = n2, p2
+        return ('+', tuple(sorted(p1+p2)), tuple(sorted(n1+n2)))
+    (p1, n1), (p2, n2) = _factors(x), _factors(y)
+    if op == '/' : p2, n2 = n2, p2
+    return ('*', tuple(sorted(p1+p2)), tuple(sorted(n1+n2)))
+
+def _operands(x, op, v, vb) :
+    """已知左边的值x、运算op和结果v，右边可取的值（限于vb中）。"""
+    if op == '+' :
+        ys = (v-x,)
+    elif op == '-' :
+        ys = (x-v,)
+    elif op == '*' :
+        if x == 0 :
+            return vb if v == 0 else ()
+        ys = (v/x,)
+    else :      # '/'
+        if v == 0 :
+            return [ y for y in vb if y ] if x == 0 else ()
+        ys = (x/v,)
+    return [ y for y in ys if y in vb and (op != '/' or y) ]
+
+@lru_cache(maxsize=None)
+def _exprs(ms, v) :
+    """多重集ms算出值v的所有表达式的标准形式。"""
+    if len(ms) == 1 :
+        return frozenset( (('n', ms[0]),) ) if v == ms[0] else frozenset()
+    res = set()
+    for a, b in _splits(ms) :
+        for l, r in ((a, b), (b, a)) if a != b else ((a, b),) :
+            vr = values(r)
+            for x in values(l) :
+                for op in '+-*/' :
+                    for y in _operands(x, op, v, vr) :
+                        for ex in _exprs(l, x) :
+                            for ey in _exprs(r, y) :
+                                res.add( _combine(op, ex, ey) )
+    return frozenset(res)
+
+def to_string(e, inner=False) :
+    """标准形式 -> 中缀表达式，只在需要时加括号。"""
+    if e[0] == 'n' :
+        return str(e[1])
+    elif e[0] == '+' :
+        s = '+'.join( to_string(t) for t in e[1] ) + ''.join( '-'+to_string(t, True) for t in e[2] )
+        return '('+s+')' if inner else s
+    return '*'.join( to_string(f, True) for f in e[1] ) + ''.join( '/'+to_string(f, True) for f in e[2] )
+
+def solvable(nums, target=24) :
+    return Fraction(target) in values(tuple(sorted(nums)))
+
+def cal24(n4, target=24) :
+    """输入若干个整数，列出(generator)结果为target的表达式，每个标准形式一个。
     """
-    def RPNs(n4) :
-        for a in set( itertools.permutations(n4) ) :
-            for x in itertools.product('+-*/', repeat=3) :
-                yield (a[0], a[1], x[0], a[2], x[1], a[3], x[2])
-                yield (a[0], a[1], x[0], a[2], a[3], x[1], x[2])
-                yield (a[0], a[1], a[2], x[0], x[1], a[3], x[2])
-                yield (a[0], a[1], a[2], x[0], a[3], x[1], x[2])
-                yield (a[0], a[1], a[2], a[3], x[0], x[1], x[2])
-                
-    for e in RPNs(n4) :
-        try :
-            n, s = expr_RPN(e)
-            if n == 24 :
-                yield s
-        except Exception :
-            pass
-
-def cal_one(n4) :
-    for s in cal24(n4) :
-        print(s[1:-1])
-
-def cal_all() :
-    for n4 in itertools.product(range(1,11), repeat=4) :
-        try :
-            next( cal24(n4) )
-        except StopIteration :
-            print(n4[0], n4[1], n4[2], n4[3])
+    ms = tuple(sorted(n4))
+    if Fraction(target) in values(ms) :
+        yield from sorted( to_string(e) for e in _exprs(ms, Fraction(target)) )
+
+# --- 可解性表 -------------------------------------------------------------
+# 对lo..hi之间的count个数的所有多重集预先求解，表中记录能否算出target、不同解法的个数和一个标准解法。
+# 表存成JSON文件，键是排好序的数用空格连接，查询时不必再求解。
+
+def _entry(ms, target) :
+    exprs = list(cal24(ms, target))
+    return ms, (bool(exprs), len(exprs), exprs[0] if exprs else None)
+
+def sweep(lo=1, hi=10, count=4, target=24, workers=None) :
+    """求解lo..hi之间count个数的所有多重集（4个1..10的数是715个，而不是10^4个有序组合），在进程池上并行。
+
+    >>> t = sweep(1, 3, 2, 3, workers=1)
+    >>> t['entries']
+    {(1, 1): (False, 0, None), (1, 2): (True, 1, '1+2'), (1, 3): (True, 2, '1*3'), (2, 2): (False, 0, None), (2, 3): (False, 0, None), (3, 3): (False, 0, None)}
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    todo = list(itertools.combinations_with_replacement(range(lo, hi+1), count))
+    if workers == 1 :
+        done = [ _entry(ms, target) for ms in todo ]
+    else :
+        with ProcessPoolExecutor(workers) as ex :
+            done = list(ex.map(_entry, todo, itertools.repeat(target), chunksize=16))
+    return { 'lo' : lo, 'hi' : hi, 'count' : count, 'target' : target, 'entries' : dict(done) }
+
+def save_table(path, table) :
+    import json, os
+    data = dict(table, entries=dict( (' '.join(map(str, ms)), e) for ms,e in table['entries'].items() ))
+    with open(path+'.tmp', 'w', encoding='utf-8') as f :
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(path+'.tmp', path)
+
+def load_table(path) :
+    import json
+    with open(path, encoding='utf-8') as f :
+        table = json.load(f)
+    table['entries'] = dict( (tuple(map(int, k.split())), tuple(e)) for k,e in table['entries'].items() )
+    return table
+
+def lookup(table, nums, target=24) :
+    """查表，返回(能否算出, 解法个数, 一个解法)；不在表的范围内返回None。"""
+    if table is None or table['target'] != target :
+        return None
+    return table['entries'].get(tuple(sorted(nums)))
+
+def cal_one(n4, target=24, table=None) :
+    """列出所有解法；给出可解性表时直接查表，只列出标准解法和解法个数。"""
+    entry = lookup(table, n4, target)
+    if entry is None :
+        for s in cal24(n4, target) :
+            print(s)
+    elif entry[0] :
+        print(entry[2], '（共%d种）' % entry[1])
+
+def cal_all(lo=1, hi=10, count=4, target=24, table=None) :
+    """列出所有不能算出target的多重集。"""
+    if table is None :
+        table = sweep(lo, hi, count, target)
+    for ms, (ok, n, s) in sorted(table['entries'].items()) :
+        if not ok :
+            print(*ms)
 
 if __name__ == '__main__' :
+    import os
     import argparse
     parser = argparse.ArgumentParser(description = '计算24点。')
     parser.add_argument('-a', '--all', action='store_true'
                                     , help='找出所有不能计算24的数字组合。')
-    parser.add_argument('-n', metavar=('N1', 'N2', 'N3', 'N4'), type=int, nargs=4
+    parser.add_argument('-n', metavar='N', type=int, nargs='+'
                                     , help='从命令行读入整数。')
+    parser.add_argument('-t', '--table', metavar='FILE'
+                                    , help='可解性表文件，不存在时求解后保存，之后直接查表。')
+    parser.add_argument('--target', type=int, default=24, help='目标值，缺省为24。')
+    parser.add_argument('--range', metavar=('LO', 'HI'), type=int, nargs=2, default=(1, 10)
+                                    , help='可解性表里数的范围，缺省为1 10。')
+    parser.add_argument('--count', type=int, default=4, help='可解性表里每组数的个数，缺省为4。')
     args = parser.parse_args()
 
+    table = None
+    if args.table and os.path.exists(args.table) :
+        table = load_table(args.table)
+    elif args.table or args.all :
+        table = sweep(*args.range, args.count, args.target)
+        if args.table :
+            save_table(args.table, table)
+
     if args.all :
-        cal_all()
+        cal_all(table=table)
     elif args.n is not None :
-        cal_one(args.n)
+        cal_one(args.n, args.target, table)
     else :
         while True :
             try :
-                line = input('输入四个整数：')
+                line = input('输入%d个整数：' % args.count)
                 print(line)
-                cal_one([ int(n) for n in line.split() ])
+                cal_one([ int(n) for n in line.split() ], args.target, table)
             except EOFError :
                 break
@@ -26,7 +26,8 @@ def alloc(seq, grp) :
             else ( (s1, *ss) for s1,s2 in  alloc2(seq, grp[0]) for ss in alloc(s2, grp[1:]) )
 '''
 import collections
-from functools import reduce
+import itertools
+from functools import lru_cache, reduce
 
 class _orderedCounter(collections.Counter, collections.OrderedDict) :
     pass
@@ -42,71 +43,589 @@ def partitions(n, m=0, r=0) :
     elif m == 1 : yield (n, )
 
 
-def _alloc2(seq, n, r) :
-    if r > 0 :
-        if n > r :
-            for i in range(len(seq)) :
-                cnt = seq[i][1] if seq[i][1] else r
-                for k in range( min(cnt, r), 0, -1) :
-                    a = ((seq[i][0],k),)
-                    b = ((seq[i][0],cnt-k),) if cnt > k else ()
-                    for s1,s2 in _alloc2(seq[i+1:], n-cnt, r-k) :
-                        yield a+s1, seq[:i]+b+s2
-                n -= cnt
-        elif n == r : yield seq, ()
-    elif r == 0 : yield (), seq
+# --- 迭代引擎 -----------------------------------------------------------------
+# 序列先化成不同元素的个数pool（按首次出现的顺序）。allocations逐组选取，groups逐批选取相邻的大小相同的几组。
+# 每一步的各种取法只取决于(剩余的pool, 这一步)，连同这一步的结果一起产出，用下标栈像里程表一样组合各步，
+# 每产出一个结果只需一次元组构造，不经过各层生成器逐级传递，也不用+反复拼接。
+# 第一步以外的各步会反复遇到相同的pool，取法不多于MEMO_LIMIT种时记下来重用。
+
+MEMO_LIMIT = 4096
+
+def _prepare(seq) :
+    """-> (各元素的个数, 各元素长度为1的切片, 把若干片段连接成与seq同类型的序列的函数)"""
+    keys = list(_orderedCounter(seq).items())
+    pool = tuple( cnt for key,cnt in keys )
+    units = [ seq[seq.index(key):seq.index(key)+1] for key,cnt in keys ]
+    join = getattr(seq[:0], 'join', None)
+    if join is None :
+        kind = type(seq[:0])
+        join = lambda parts : kind(itertools.chain.from_iterable(parts))
+    return pool, units, join
+
+def _vectors(pool, r) :
+    """pool中大小为r的子多重集，按个数向量的字典序从大到小产出(idx, x)：
+       idx是pool中不为0的位置，x是各位置取的个数（产出的是同一个列表，就地修改）。"""
+    idx = [ j for j,c in enumerate(pool) if c ]
+    cap = [ pool[j] for j in idx ]
+    m = len(idx)
+    suffix = [0]*(m+1)
+    for j in range(m-1, -1, -1) :
+        suffix[j] = suffix[j+1] + cap[j]
+    if r < 0 or suffix[0] < r :
+        return
+    x = [0]*m
+    need = r
+    for j in range(m) :
+        x[j] = min(cap[j], need)
+        need -= x[j]
+    while True :
+        yield idx, x
+        right, j = 0, m-1       # 从右向左找第一个能把一个移到右边的位置
+        while j >= 0 and not (x[j] and suffix[j+1] > right) :
+            right += x[j]
+            j -= 1
+        if j < 0 :
+            return
+        x[j] -= 1
+        need = right+1
+        for k in range(j+1, m) :
+            x[k] = min(cap[k], need)
+            need -= x[k]
+
+def _take(pool, idx, x) :
+    rest = list(pool)
+    for j,k in zip(idx, x) :
+        rest[j] -= k
+    return tuple(rest)
+
+def _batches(grp) :
+    """相邻的大小相同的组合成一批：((组数, 大小), ...)"""
+    steps, t = [], 0
+    while t < len(grp) :
+        m = next( (i for i in range(t+1, len(grp)) if grp[i]!=grp[t]), len(grp) ) - t
+        steps.append( (m, grp[t]) )
+        t += m
+    return tuple(steps)
+
+def _cached(memo, key, make) :
+    """make()产出的迭代器；不多于MEMO_LIMIT项时存入memo，下次直接重用。"""
+    res = memo.get(key)
+    if res is not None :
+        return iter(res)
+    it = make()
+    res = list(itertools.islice(it, MEMO_LIMIT+1))
+    if len(res) <= MEMO_LIMIT :
+        memo[key] = res
+        return iter(res)
+    return itertools.chain(res, it)
+
+def _odometer(pool, steps, choices) :
+    """choices(pool, t)产出(剩余的pool, 第t步的结果)；按顺序组合各步的选择，产出各步结果的列表（同一个列表）。"""
+    g = len(steps)
+    if g == 0 :
+        yield []
+        return
+    res = [None]*g
+    its = [ choices(pool, 0) ] + [None]*(g-1)
+    t = 0
+    while t >= 0 :
+        if t == g-1 :           # 最后一步直接逐个产出
+            for pool, res[t] in its[t] :
+                yield res
+            t -= 1
+            continue
+        nxt = next(its[t], None)
+        if nxt is None :
+            t -= 1
+            continue
+        pool, res[t] = nxt
+        t += 1
+        its[t] = choices(pool, t)
 
 
 def allocations(seq, grp) :
-    def do_alloc(seq, n, grp) :
-        if len(grp) > 0 :
-            for s1,s2 in _alloc2(seq, n, grp[0]) :
-                for ss in do_alloc(s2, n-grp[0], grp[1:]) :
-                    yield (s1, *ss)
-        else : yield ()
-    nn = len(seq)
-    ss = tuple( (seq.index(key), cnt) for key,cnt in (_orderedCounter(seq).items()) )
-    for result in do_alloc(ss, nn, grp) :
-        yield tuple( reduce(lambda x,y:x+y, (seq[ind:ind+1]*cnt for ind,cnt in group), seq[:0]) for group in result )
+    """把seq分成大小依次为grp的若干组，组有先后。"""
+    pool, units, join = _prepare(seq)
+    memo = {}
+    def row(pool, r) :
+        for idx, x in _vectors(pool, r) :
+            yield _take(pool, idx, x), join( units[j]*k for j,k in zip(idx, x) if k )
+    def choices(pool, t) :
+        return row(pool, grp[t]) if t == 0 else _cached(memo, (pool, grp[t]), lambda : row(pool, grp[t]))
+    return ( tuple(res) for res in _odometer(pool, grp, choices) )
 
 
 def groups(seq, grp) :
-    def equ_grp(seq, n, m) :
-        if m > 1 :
-            r = n//m
-            if r > 0 :
-                cnt = seq[0][1]
-                for gen in partitions(cnt, m, r) :
-                    pre = tuple( (seq[0][0], g) for g in gen )
-                    grp = tuple( r-c for c in gen )
-                    for ss in do_grp(seq[1:], n-cnt, grp) :
-                        yield tuple( (a,)+s for a,s in zip(pre, ss) )
-            elif r == 0 : yield ((), )*m
-        elif m == 1 : yield (seq, )
-    def do_grp(seq, n, grp) :
-        if len(grp) > 0 :
-            m = next( (i for i in range(1, len(grp)) if grp[i]!=grp[0]), len(grp) )
-            ne = grp[0]*m
-            for s1,s2 in _alloc2(seq, n, ne) :
-                for se in equ_grp(s1, ne, m) :
-                    for ss in do_grp(s2, n-ne, grp[m:]) :
-                        yield (*se, *ss)
-        else : yield ()
-    nn = len(seq)
-    ss = tuple( (seq.index(key), cnt) for key,cnt in (_orderedCounter(seq).items()) )
-    for result in do_grp(ss, nn, grp) :
-        yield tuple( reduce(lambda x,y:x+y, (seq[ind:ind+1]*cnt for ind,cnt in group), seq[:0]) for group in result )
+    """同allocations，但相邻的大小相同的组不分先后，只产出一次。"""
+    pool, units, join = _prepare(seq)
+    empty = seq[:0]
+    memo = {}
+    def split(u, m, r) :
+        """把u分成m个大小为r的组，不分先后：第一种元素按partitions分配，各组剩余容量相等的又成一批。"""
+        if m == 1 :
+            yield (join( units[j]*k for j,k in enumerate(u) if k ),)
+        elif r == 0 :
+            yield (empty,)*m
+        else :
+            j = next( j for j,k in enumerate(u) if k )
+            rest = u[:j] + (0,) + u[j+1:]
+            for gen in partitions(u[j], m, r) :
+                heads = [ units[j]*g for g in gen ]
+                steps = _batches( [ r-g for g in gen ] )
+                for res in _odometer(rest, steps, lambda pool, t : choices(pool, steps[t], t == 0)) :
+                    yield tuple( join((h, s)) for h,s in zip(heads, itertools.chain.from_iterable(res)) )
+    def batch(pool, step) :
+        m, r = step
+        for idx, x in _vectors(pool, r*m) :
+            u = [0]*len(pool)
+            for j,k in zip(idx, x) :
+                u[j] = k
+            rest = _take(pool, idx, x)
+            for parts in split(tuple(u), m, r) :
+                yield rest, parts
+    def choices(pool, step, first) :
+        return batch(pool, step) if first else _cached(memo, (pool, step), lambda : batch(pool, step))
+    steps = _batches(grp)
+    return ( tuple(itertools.chain.from_iterable(res)) for res in _odometer(pool, steps, lambda pool, t : choices(pool, steps[t], t == 0)) )
 
 
 def combinations(seq, r) :
     return ( a for a,b in allocations(seq, (r, len(seq)-r)) )
 
 def permutations(seq, r) :
-    return ( reduce(lambda x,y:x+y, g, seq[:0]) for g in allocations(seq, tuple(1 for i in range(r))) )
+    join = _prepare(seq)[2]
+    return ( join(g) for g in allocations(seq, tuple(1 for i in range(r))) )
 
 def fact(n) :
     return n*fact(n-1) if n>0 else 1
 
+
+# --- 计数、排名与反排名 ---------------------------------------------------------
+# 各种枚举都是逐步选择，每一步的各种选择按顺序排列，选定之后剩下的结果数只取决于剩余的个数pool和之后的步骤。
+# 记下这些结果数（与元素本身无关，只与个数有关），就能不枚举而算出总数，由结果算出序号(rank)，由序号还原结果(unrank)。
+# allocations是每批一组的groups，combinations、permutations是特殊的allocations。
+
+# 这些计数是递归的动态规划，缓存容量有限时一旦状态数超过容量就会反复重算，因此不限容量，
+# 数据量很大之后可以用_n_groups.cache_clear()、_n_split.cache_clear()释放。
+@lru_cache(maxsize=None)
+def _n_groups(pool, steps) :
+    """从pool中依次取出steps各批的分法数。"""
+    if not steps :
+        return 1
+    (m, r), rest = steps[0], steps[1:]
+    return sum( _n_split(_dense(idx, x, len(pool)), m, r) * _n_groups(_take(pool, idx, x), rest) for idx, x in _vectors(pool, r*m) )
+
+@lru_cache(maxsize=None)
+def _n_split(u, m, r) :
+    """把u分成m个大小为r、不分先后的组的分法数。"""
+    if m == 1 or r == 0 :
+        return 1
+    j = next( j for j,k in enumerate(u) if k )
+    rest = u[:j] + (0,) + u[j+1:]
+    return sum( _n_groups(rest, _batches([ r-g for g in gen ])) for gen in partitions(u[j], m, r) )
+
+def _dense(idx, x, m) :
+    v = [0]*m
+    for j,k in zip(idx, x) :
+        v[j] = k
+    return tuple(v)
+
+def _rank_groups(pool, steps, rows) :
+    rank = 0
+    for t, (m, r) in enumerate(steps) :
+        batch, rows = rows[:m], rows[m:]
+        u = tuple( sum(ks) for ks in zip(*batch) )
+        after = steps[t+1:]
+        for idx, x in _vectors(pool, r*m) :
+            v = _dense(idx, x, len(pool))
+            if v == u :
+                rank += _rank_split(u, m, r, batch) * _n_groups(_take(pool, idx, x), after)
+                pool = _take(pool, idx, x)
+                break
+            rank += _n_split(v, m, r) * _n_groups(_take(pool, idx, x), after)
+        else :
+            raise ValueError('not in the enumeration')
+    return rank
+
+def _rank_split(u, m, r, rows) :
+    if m == 1 or r == 0 :
+        return 0
+    j = next( j for j,k in enumerate(u) if k )
+    rest = u[:j] + (0,) + u[j+1:]
+    key = tuple( row[j] for row in rows )
+    rank = 0
+    for gen in partitions(u[j], m, r) :
+        steps = _batches([ r-g for g in gen ])
+        if gen == key :
+            return rank + _rank_groups(rest, steps, [ row[:j] + (0,) + row[j+1:] for row in rows ])
+        rank += _n_groups(rest, steps)
+    raise ValueError('not in the enumeration')
+
+def _unrank_groups(pool, steps, index) :
+    rows = []
+    for t, (m, r) in enumerate(steps) :
+        after = steps[t+1:]
+        for idx, x in _vectors(pool, r*m) :
+            v = _dense(idx, x, len(pool))
+            n = _n_groups(_take(pool, idx, x), after)
+            c = _n_split(v, m, r) * n
+            if index < c :
+                q, index = divmod(index, n)
+                rows += _unrank_split(v, m, r, q)
+                pool = _take(pool, idx, x)
+                break
+            index -= c
+    return rows
+
+def _unrank_split(u, m, r, index) :
+    if m == 1 :
+        return [u]
+    elif r == 0 :
+        return [u]*m
+    j = next( j for j,k in enumerate(u) if k )
+    rest = u[:j] + (0,) + u[j+1:]
+    for gen in partitions(u[j], m, r) :
+        steps = _batches([ r-g for g in gen ])
+        c = _n_groups(rest, steps)
+        if index < c :
+            return [ row[:j] + (g,) + row[j+1:] for g,row in zip(gen, _unrank_groups(rest, steps, index)) ]
+        index -= c
+
+def _vector(group, pos, m) :
+    v = [0]*m
+    for e in group :
+        if e not in pos :
+            raise ValueError('not in the enumeration')
+        v[pos[e]] += 1
+    return tuple(v)
+
+def _rank(seq, steps, result) :
+    pool, units, join = _prepare(seq)
+    pos = dict( (u[0], j) for j,u in enumerate(units) )
+    return _rank_groups(pool, steps, [ _vector(g, pos, len(pool)) for g in result ])
+
+def _unrank(seq, steps, index) :
+    pool, units, join = _prepare(seq)
+    if not 0 <= index < _n_groups(pool, steps) :
+        raise IndexError('index out of range', index)
+    return tuple( join( units[j]*k for j,k in enumerate(row) if k ) for row in _unrank_groups(pool, steps, index) )
+
+def _alloc_steps(grp) :
+    return tuple( (1, r) for r in grp )
+
+
+def _mul(c, j) :
+    """c(q) *= 1-q^j，截断到原长度。"""
+    if j < len(c) :
+        c[j:] = [ x-y for x,y in zip(c[j:], c[:len(c)-j]) ]
+
+def _div(c, j) :
+    """c(q) /= 1-q^j，即按模j的各个剩余类做前缀和。"""
+    for a in range(min(j, len(c))) :
+        c[a::j] = itertools.accumulate(c[a::j])
+
+def _box(n, m, r) :
+    """Gauss二项式[m+r, m]_q截断到q^n的系数表：第x项是x分成至多m份、每份不超过r的分法数。
+       x <= n时至多n份、每份不超过n，m、r可以先截到n；逐个乘(1-q^(t+i))/(1-q^i)，i=1..s，(s, t)是(m, r)中小的和大的。"""
+    s, t = sorted((min(m, n), min(r, n)))
+    c = [1] + [0]*n
+    for i in range(1, s+1) :
+        _mul(c, t+i)
+        _div(c, i)
+    return c
+
+def _shrink(c, m, r, m2, r2) :
+    """把_box(n, m, r)就地改成_box(n, m2, r2)，m2 <= m，r2 <= r。
+       [m+r, m] = [m+r-1, m]*(1-q^(m+r))/(1-q^r)，反过来每次r减一只需一次乘除，m减一同理，都是O(n)。"""
+    n = len(c)-1
+    m, r, m2, r2 = min(m, n), min(r, n), min(m2, n), min(r2, n)
+    while r > r2 :
+        _mul(c, r)
+        _div(c, m+r)
+        r -= 1
+    while m > m2 :
+        _mul(c, m)
+        _div(c, m+r)
+        m -= 1
+
+def _euler(n) :
+    """不加限制的分拆数p(0..n)，Euler五边形数递推p(x) = Σ ±p(x - k(3k∓1)/2)，O(n^1.5)。"""
+    p = [1] + [0]*n
+    for x in range(1, n+1) :
+        k, s = 1, 0
+        while k*(3*k-1)//2 <= x :
+            t = p[x - k*(3*k-1)//2] + (p[x - k*(3*k+1)//2] if k*(3*k+1)//2 <= x else 0)
+            s += t if k&1 else -t
+            k += 1
+        p[x] = s
+    return p
+
+@lru_cache(maxsize=1024)
+def count_partitions(n, m=0, r=0) :
+    """partitions(n, m, r)产出的个数：n分成m份（可以为0）、每份不超过r、从大到小排列的分法数，
+       即Gauss二项式[m+r, m]_q中q^n的系数，时间O(min(m, r, n)*n)；m、r都不限制时用五边形数递推。
+
+    >>> count_partitions(5, 3, 3), count_partitions(100)
+    (3, 190569292)
+    >>> count_partitions(900)
+    415873681190459054784114365430
+    """
+    m = m if m else n
+    r = r if r else n
+    if m >= n and r >= n and n > 1 :
+        return _euler(n)[n]
+    elif m > 1 :
+        return _box(n, m, r)[n]
+    return 1 if m == 1 else 0
+
+def count_allocations(seq, grp) :
+    """allocations(seq, grp)产出的个数。元素各不相同时是多项式系数。
+
+    >>> count_allocations('111123478', (2, 2, 2, 3)), count_allocations('abcdefghijkl', (3, 3, 3, 3))
+    (690, 369600)
+    """
+    pool = _prepare(seq)[0]
+    left = len(seq) - sum(grp)
+    if max(pool, default=0) <= 1 and left >= 0 and min(grp, default=0) >= 0 :
+        return fact(len(seq)) // reduce(lambda x,y:x*y, ( fact(g) for g in grp ), fact(left))
+    return _n_groups(pool, _alloc_steps(grp))
+
+def count_groups(seq, grp) :
+    """groups(seq, grp)产出的个数。
+
+    >>> count_groups('111123478', (2, 2, 2, 3)), count_groups('aabbccddeeffgg', (3, 3, 4, 4))
+    (120, 30030)
+    """
+    return _n_groups(_prepare(seq)[0], _batches(grp))
+
+def count_combinations(seq, r) :
+    """combinations(seq, r)产出的个数：各元素的生成多项式1+x+...+x^c的乘积中x^r的系数。
+
+    >>> count_combinations((1, 1, 1, 2, 2, 3), 3)
+    6
+    """
+    poly = [1]
+    for c in _prepare(seq)[0] :
+        poly = [ sum( poly[k-i] for i in range(max(0, k-len(poly)+1), min(c, k)+1) ) for k in range(len(poly)+c) ]
+    return poly[r] if 0 <= r < len(poly) else 0
+
+def count_permutations(seq, r) :
+    """permutations(seq, r)产出的个数：逐个加入元素，长为k的排列中放入i个新元素有C(k, i)种位置。
+
+    >>> count_permutations((1, 1, 1, 2, 2, 3), 2), count_permutations('mississippi', 11)
+    (8, 34650)
+    """
+    f = [1]
+    for c in _prepare(seq)[0] :
+        f = [ sum( f[k-i]*_binom(k, i) for i in range(max(0, k-len(f)+1), min(c, k)+1) ) for k in range(len(f)+c) ]
+    return f[r] if 0 <= r < len(f) else 0
+
+def _binom(n, k) :
+    return fact(n) // (fact(k)*fact(n-k))
+
+def rank_partition(p, n, m=0, r=0) :
+    """p在partitions(n, m, r)中的序号。
+       第一份大于i的分法数是N(n, m, r) - N(n, m, i)（N即_box的系数），逐份确定时m、r只减不增，
+       系数表随之用_shrink就地更新，总共O((m+r)*n)。
+
+    >>> rank_partition((2, 2, 1), 5, 3, 3), unrank_partition(2, 5, 3, 3)
+    (2, (2, 2, 1))
+    >>> p = unrank_partition(10**15, 300)
+    >>> rank_partition(p, 300)
+    1000000000000000
+    """
+    m = m if m else n
+    r = r if r else n
+    c = _box(n, m, r)
+    rank = 0
+    for k, part in enumerate(p[:-1]) :
+        mk = m-k
+        total = c[n]
+        _shrink(c, mk, r, mk, part)
+        rank += total - c[n]
+        _shrink(c, mk, part, mk-1, part)
+        n, r = n-part, part
+    return rank
+
+def unrank_partition(index, n, m=0, r=0) :
+    m = m if m else n
+    r = r if r else n
+    if not 0 <= index < count_partitions(n, m, r) :
+        raise IndexError('index out of range', index)
+    c = _box(n, m, r)
+    p = []
+    while m > 1 and n > 0 :
+        total = c[n]
+        i = min(n, r)
+        _shrink(c, m, r, m, i)
+        while True :            # 第一份从大到小试，跳过的分法数是total - N(n, m, i-1)
+            box = c[:]
+            _shrink(c, m, i, m, i-1)
+            if total - c[n] > index :
+                break
+            i -= 1
+        index -= total - box[n]
+        c = box
+        _shrink(c, m, i, m-1, i)
+        p.append(i)
+        n, m, r = n-i, m-1, i
+    return tuple(p) + (n,) + (0,)*(m-1)
+
+def rank_allocation(seq, grp, result) :
+    """result在allocations(seq, grp)中的序号，不必枚举它前面的结果。
+
+    >>> rank_allocation('111123478', (2, 2, 2, 3), ('78', '34', '12', '111'))
+    689
+    >>> unrank_allocation('111123478', (2, 2, 2, 3), 689)
+    ('78', '34', '12', '111')
+    """
+    return _rank(seq, _alloc_steps(grp), result)
+
+def unrank_allocation(seq, grp, index) :
+    return _unrank(seq, _alloc_steps(grp), index)
+
+def rank_group(seq, grp, result) :
+    """result在groups(seq, grp)中的序号；大小相同的组必须按groups产出的次序排列。
+
+    >>> [ rank_group('aabc', (2, 2), g) for g in groups('aabc', (2, 2)) ]
+    [0, 1]
+    >>> unrank_group('aabbccddeeffgg', (3, 3, 4, 4), 30029)
+    ('efg', 'efg', 'abcd', 'abcd')
+    """
+    return _rank(seq, _batches(grp), result)
+
+def unrank_group(seq, grp, index) :
+    return _unrank(seq, _batches(grp), index)
+
+def rank_combination(seq, r, comb) :
+    """comb在combinations(seq, r)中的序号。
+
+    >>> rank_combination((1, 1, 1, 2, 2, 3), 3, (1, 2, 3)), unrank_combination((1, 1, 1, 2, 2, 3), 3, 4)
+    (4, (1, 2, 3))
+    """
+    pool, units, join = _prepare(seq)
+    pos = dict( (u[0], j) for j,u in enumerate(units) )
+    v = _vector(comb, pos, len(pool))
+    return _rank_groups(pool, _alloc_steps((r, len(seq)-r)), [v, tuple( c-k for c,k in zip(pool, v) )])
+
+def unrank_combination(seq, r, index) :
+    return _unrank(seq, _alloc_steps((r, len(seq)-r)), index)[0]
+
+def rank_permutation(seq, r, perm) :
+    """perm在permutations(seq, r)中的序号。
+
+    >>> rank_permutation('mississippi', 11, 'mississippi'), unrank_permutation('mississippi', 11, 0)
+    (674, 'miiiisssspp')
+    """
+    return _rank(seq, _alloc_steps((1,)*r), [ perm[i:i+1] for i in range(len(perm)) ])
+
+def unrank_permutation(seq, r, index) :
+    return _prepare(seq)[2](_unrank(seq, _alloc_steps((1,)*r), index))
+
+
+# --- 批量下标数组 ---------------------------------------------------------------
+# 结果不逐个构造元组，而是写进NumPy整数数组，每个元素记为它在seq的不同元素（按首次出现的顺序）中的下标。
+# 沿allocations的选择树向下，剩余结果数不超过chunk的子树整体做成一张表：表由各个选择的表拼接而成，
+# 相同(剩余的pool, 剩余的组)的表记下来重用，于是Python的开销只与不同的子树个数有关，与结果个数无关。
+
+try :
+    import numpy as np
+except ImportError :
+    np = None
+
+CHUNK = 1<<16           # 缺省每块的结果数
+TABLE_CELLS = 1<<22     # 记下的子树表的元素总数上限，超过就清空重来
+
+def _arrays(seq, grp, chunk, shape, dtype, out) :
+    """按allocations(seq, grp)的顺序产出下标数组块，每块的形状为(块内个数,) + shape。"""
+    if np is None :
+        raise ImportError('numpy is required for the array interface')
+    dtype = dtype or (out.dtype if out is not None else np.intp)
+    memo = {}
+    cells = 0
+    def table(pool, grp) :
+        """pool按grp依次分组的全部结果，形状(个数, sum(grp))。"""
+        nonlocal cells
+        tbl = memo.get((pool, grp))
+        if tbl is not None :
+            return tbl
+        elif not grp :
+            return np.zeros((1, 0), dtype=dtype)
+        parts = []
+        for idx, x in _vectors(pool, grp[0]) :
+            sub = table(_take(pool, idx, x), grp[1:])
+            part = np.empty((len(sub), sum(grp)), dtype=dtype)
+            part[:, :grp[0]] = np.repeat(idx, x)
+            part[:, grp[0]:] = sub
+            parts.append(part)
+        tbl = np.concatenate(parts) if parts else np.zeros((0, sum(grp)), dtype=dtype)
+        cells += tbl.size
+        if cells > TABLE_CELLS :
+            memo.clear()
+            cells = tbl.size
+        memo[(pool, grp)] = tbl
+        return tbl
+    def blocks(pool, grp) :
+        """产出(前缀, 表)：前缀是这些结果共同的开头几组，表是其后的部分，不超过chunk行。"""
+        if _n_groups(pool, _alloc_steps(grp)) <= chunk :
+            yield np.zeros(0, dtype=dtype), table(pool, grp)
+            return
+        for idx, x in _vectors(pool, grp[0]) :
+            head = np.repeat(idx, x)
+            for prefix, tbl in blocks(_take(pool, idx, x), grp[1:]) :
+                yield np.concatenate((head, prefix)), tbl
+
+    width = sum(grp)
+    new = lambda : out.reshape(-1, width) if out is not None else np.empty((chunk, width), dtype=dtype)
+    buf = new()
+    chunk = len(buf)
+    n = 0
+    for prefix, tbl in blocks(_prepare(seq)[0], grp) :
+        k, i = len(prefix), 0
+        while i < len(tbl) :
+            m = min(len(tbl)-i, chunk-n)
+            buf[n:n+m, :k] = prefix
+            buf[n:n+m, k:] = tbl[i:i+m]
+            n, i = n+m, i+m
+            if n == chunk :
+                yield buf.reshape((n,) + shape)
+                buf, n = new(), 0
+    if n :
+        yield buf[:n].reshape((n,) + shape)
+
+def allocation_arrays(seq, grp, chunk=CHUNK, dtype=None, out=None) :
+    """allocations(seq, grp)的批量形式：按同样的顺序产出若干块下标数组，每块至多chunk个结果。
+       各组大小相同时形状为(块内个数, 组数, 组的大小)，否则为(块内个数, sum(grp))，各组首尾相接。
+       dtype缺省为np.intp；给出out时每块都写进out（形状同上，首维为chunk），取下一块之前要用完这一块。
+
+    >>> keys = list(_orderedCounter('aabc'))
+    >>> [ tuple( ''.join(keys[i] for i in g) for g in a ) for blk in allocation_arrays('aabc', (2, 2)) for a in blk.tolist() ]
+    [('aa', 'bc'), ('ab', 'ac'), ('ac', 'ab'), ('bc', 'aa')]
+    >>> [ blk.shape for blk in allocation_arrays('111123478', (2, 2, 2, 3), chunk=500) ]
+    [(500, 9), (190, 9)]
+    """
+    grp = tuple(grp)
+    shape = (len(grp), grp[0]) if len(set(grp)) == 1 else (sum(grp),)
+    return _arrays(seq, grp, chunk, shape, dtype, out)
+
+def combination_arrays(seq, r, chunk=CHUNK, dtype=None, out=None) :
+    """combinations(seq, r)的批量形式，每块形状为(块内个数, r)。
+
+    >>> next(combination_arrays((1, 1, 1, 2, 2, 3), 3)).tolist()
+    [[0, 0, 0], [0, 0, 1], [0, 0, 2], [0, 1, 1], [0, 1, 2], [1, 1, 2]]
+    """
+    return _arrays(seq, (r,), chunk, (r,), dtype, out)
+
+def permutation_arrays(seq, r, chunk=CHUNK, dtype=None, out=None) :
+    """permutations(seq, r)的批量形式，每块形状为(块内个数, r)。
+
+    >>> next(permutation_arrays((1, 1, 1, 2, 2, 3), 2)).tolist()
+    [[0, 0], [0, 1], [0, 2], [1, 0], [1, 1], [1, 2], [2, 0], [2, 1]]
+    >>> sum( len(blk) for blk in permutation_arrays('mississippi', 11, chunk=10000) )
+    34650
+    """
+    return _arrays(seq, (1,)*r, chunk, (r,), dtype, out)
+
 if __name__ == '__main__' :
 #    breakpoint()
 #    print( *list(partitions(20,3,10)), sep='\n')
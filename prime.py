@@ -17,22 +17,153 @@ False
 >>> repunit_prime('1', 10)
 {1, 2}
 
-增加is_primeM(n)做Miller Rabin素性测试，MR_test(a,n)用于发现强伪素数（返回值帮助分解因子，算法有待实现）
+增加is_primeM(n)做Miller Rabin素性测试，MR_test(a,n)用于发现强伪素数（返回的1的非平凡平方根被factorize用来分解因子）
 
 >>> is_primeM(1111111)
 False
 >>> MR_test(2, 1111111)
 0
+
+批量判断与枚举素数使用分段筛，内存只与段长SEGMENT有关，与区间上界无关：
+
+>>> list(primes_in_range(90, 110))
+[97, 101, 103, 107, 109]
+>>> prime_count(1000000)
+78498
+>>> is_prime_many([97, 98, 99, 2, 1])
+[True, False, False, True, False]
+
+计数与第k个素数不必筛到x，prime_pi(x)用Lucy_Hedgehog算法，nth_prime(k)估计位置后只筛一小段：
+
+>>> prime_pi(10**7)
+664579
+>>> nth_prime(664579)
+9999991
 """
 
-def isqrt(n) :
-    """计算整数平方根，忽略小数部分，即找到最大整数r满足r^2 <=n and (r+1)^2 >n。
+from itertools import compress
+from functools import reduce, lru_cache
+from math import gcd
+from bisect import bisect_left, bisect_right
+
+# --- 大整数后端 ------------------------------------------------------------
+# isqrt、powermod和大数的BPSW测试交给可替换的后端：'pure'是本文件的纯Python实现，'builtin'用内置pow和math.isqrt，
+# 装有gmpy2时还有'gmpy2'（GMP的isqrt、powmod、is_strong_selfridge_prp、is_strong_bpsw_prp）。缺省选可用的最快者，use_backend(name)切换。
+import math
+try :
+    import gmpy2
+except ImportError :
+    gmpy2 = None
+
+def _isqrt_newton(n) :
+    """整数平方根的纯Python实现，找到最大整数r满足r^2 <=n and (r+1)^2 >n。
        牛顿迭代法，x <- ( x + n/x )/2，初值估计取1*2^s用公式做一次迭代。
        细致分析:
         1、用到整数除法 n//a = b，整数除法的不对称性，n=a*b+d，取决与d的大小n//a=b不一定n//b=a。
         2、整数除法n=a*b+d，若a>b且a>d，可以证明a^2> n >b^2 。
         3、对全局凹（凸）曲线，每次迭代总是从曲线单侧（背部？）逐步逼近，因而总是收敛。a> [(a+b)//2] >=b (只在a-b == 1时取等号)。
            可以证明，一般总是[(a+b)//2]^2 >n，如果[(a+b)//2]^2或[(a+b-1)//2]^2 <=n，则必有[(a+b+1)//2]^2 >n，按照定义就是平方根r。
+    """
+    if n<=0 :
+        return 0
+    c = n.bit_length()>>1
+    r = ((1<<c) + (n>>c))>>1
+    while True :
+        t = ( r + n//r )>>1
+        if t >= r :
+            break;
+        r = t
+    return r
+
+def _powermod_loop(a, b, m) :
+    """幂模的纯Python实现，从低位到高位逐位平方累乘。负指数先求模逆，与内置pow一致。"""
+    if b<0 :
+        a, b = pow(a, -1, m), -b
+    res = 1%m
+    while b>0 :
+        if b&1 :
+            res = a*res%m
+        a, b = a*a%m, b>>1
+    return res
+
+def _bpsw(n) :
+    """BPSW测试：底数2的强伪素数测试加强Lucas测试，n为没有小因子的奇数。"""
+    d = n-1
+    s = ctz(d)
+    return _sprp(n, d>>s, s, 2) and _lucas_sprp(n)
+
+BACKENDS = {    # 名字 -> (isqrt, powmod, 强Lucas测试, bpsw)
+    'pure'      : (_isqrt_newton, _powermod_loop, lambda n : _lucas_sprp(n), _bpsw),
+    'builtin'   : (lambda n : math.isqrt(n) if n>0 else 0, pow, lambda n : _lucas_sprp(n), _bpsw),
+}
+if gmpy2 is not None :
+    BACKENDS['gmpy2'] = (      # 必须是强Lucas测试，is_bpsw_prp用的普通Lucas测试会放过323这样的Lucas伪素数
+        lambda n : int(gmpy2.isqrt(n)) if n>0 else 0,
+        lambda a, b, m : int(gmpy2.powmod(a, b, m)),
+        lambda n : bool(gmpy2.is_strong_selfridge_prp(n)),
+        lambda n : bool(gmpy2.is_strong_bpsw_prp(n)),
+    )
+
+BACKEND = None
+def use_backend(name=None) :
+    """选择大整数后端，name为None时选可用的最快者（有gmpy2用gmpy2，否则builtin）。返回原来的后端名，便于恢复。
+
+    >>> old = use_backend('pure')
+    >>> isqrt(10**40+1), powermod(3, -1, 7)
+    (100000000000000000000, 5)
+    >>> use_backend(old)
+    'pure'
+    >>> use_backend('nosuch')
+    Traceback (most recent call last):
+    ...
+    ValueError: unknown backend 'nosuch'
+    """
+    global BACKEND, _isqrt_impl, _powmod_impl, _lucas_impl, _bpsw_impl
+    if name is None :
+        name = 'gmpy2' if 'gmpy2' in BACKENDS else 'builtin'
+    if name not in BACKENDS :
+        raise ValueError('unknown backend %r' % name)
+    old, BACKEND = BACKEND, name
+    _isqrt_impl, _powmod_impl, _lucas_impl, _bpsw_impl = BACKENDS[name]
+    return old
+
+use_backend()
+
+def _parity_cases() :
+    """(函数名, 参数)的列表，覆盖小数、64位边界、平方数附近和上千位的大数，以及（强）Lucas伪素数。"""
+    big = [ 2**61-1, 2**64-59, 2**64+1, 2**89-1, (2**89-1)*(2**61-1), 2**521-1, 10**300+1,
+            3825123056546413051, int('1'*317), int('1'*318) ]
+    cases = [ ('isqrt', (n, )) for n in list(range(-2, 100)) + [ x*x+d for x in big for d in (-1, 0, 1) ] ]
+    cases += [ ('powermod', (a, e, m)) for a in (0, 2, 3, 10**20+7) for e in (0, 1, 65537, 2**127-1, 10**50)
+                                       for m in (1, 2, 97, 2**61-1, 10**300+1) ]
+    cases += [ ('powermod', (3, -1, 7)), ('powermod', (10**20+7, -5, 2**521-1)) ]
+    cases += [ ('is_primeM', (n, )) for n in big + list(range(10**6, 10**6+100)) ]
+    cases += [ ('MR_test', (a, n)) for a in (2, 3, 5) for n in (341, 1729, 25326001, 3825123056546413051, 2**89-1) ]
+    lucas = [ 323, 377, 1159, 1829, 3827, 5459, 5777, 9071, 9179, 10877, 16109, 18971 ]    # Lucas伪素数，其中5459起有强Lucas伪素数
+    cases += [ (f, (n, )) for f in ('_lucas_impl', '_bpsw_impl') for n in lucas + [ 1009, 10007 ] + big ]
+    return cases
+
+def backend_parity(name) :
+    """在_parity_cases()上比较后端name与'pure'的结果，返回不一致的[(函数名, 参数), ...]，空列表表示完全一致。
+
+    >>> list(BACKENDS)[:2]
+    ['pure', 'builtin']
+    >>> [ name for name in BACKENDS if backend_parity(name) ]
+    []
+    """
+    cases = _parity_cases()
+    results = []
+    for b in ('pure', name) :
+        old = use_backend(b)
+        try :
+            results.append([ globals()[f](*args) for f, args in cases ])
+        finally :
+            use_backend(old)
+    return [ case for case, x, y in zip(cases, *results) if x != y ]
+
+def isqrt(n) :
+    """计算整数平方根，忽略小数部分，即找到最大整数r满足r^2 <=n and (r+1)^2 >n；n<=0时返回0。
+       由当前后端计算，纯Python的牛顿迭代见_isqrt_newton。
 
     >>> isqrt(0)
     0
@@ -45,16 +176,80 @@ def isqrt(n) :
     >>> isqrt(1000)
     31
     """
+    return _isqrt_impl(n)
+
+def iroot(n, k) :
+    """整数k次方根，最大整数r满足r^k <=n；n<=0时返回0。k==2交给isqrt。
+       牛顿迭代x <- ((k-1)x + n//x^(k-1))//k，与isqrt一样按n的位数估计初值：2^ceil(bits/k)不小于真值，
+       此后迭代从上方单调下降，不再下降时即是结果。
+
+    >>> iroot(0, 3)
+    0
+    >>> iroot(7, 3), iroot(8, 3), iroot(9, 3)
+    (1, 2, 2)
+    >>> iroot(10**30, 5)
+    1000000
+    >>> iroot(3**100-1, 10)
+    59048
+    >>> iroot(1000, 1), iroot(1000, 2), iroot(1000, 20)
+    (1000, 31, 1)
+    """
     if n<=0 :
         return 0
-    c = n.bit_length()>>1
-    r = ((1<<c) + (n>>c))>>1
+    elif k==1 :
+        return n
+    elif k==2 :
+        return isqrt(n)
+    x = 1 << -(-n.bit_length()//k)
     while True :
-        t = ( r + n//r )>>1
-        if t >= r :
-            break;
-        r = t
-    return r
+        y = ((k-1)*x + n//x**(k-1))//k
+        if y >= x :
+            return x
+        x = y
+
+@lru_cache(maxsize=None)
+def _power_moduli(p) :
+    """p次幂剩余的过滤用模数：四个素数q ≡ 1 (mod p)，q > 16。q不整除r时，r是模q的p次幂当且仅当r^((q-1)/p) ≡ 1，只约1/p的余数能通过。"""
+    res = []
+    q = 1
+    while len(res) < 4 :
+        q += 2*p
+        if q > 16 and is_prime(q) :
+            res.append(q)
+    return tuple(res)
+
+def perfect_power(n) :
+    """判断n是否完全幂，返回(b, e)使n == b^e且e最大；不是完全幂时返回(n, 1)。
+       对每个素数指数p，先看n末尾0的个数能否被p整除，再看n是否几个模q的p次幂剩余，都通过才用iroot开方验证；
+       成功则对b继续找，指数相乘。
+
+    >>> perfect_power(2**20)
+    (2, 20)
+    >>> perfect_power(6**15)
+    (6, 15)
+    >>> perfect_power((2**61-1)**10)
+    (2305843009213693951, 10)
+    >>> perfect_power(10**12+1)
+    (1000000000001, 1)
+    >>> [ perfect_power(n) for n in (0, 1, 2, 4, 12) ]
+    [(0, 1), (1, 1), (2, 1), (2, 2), (12, 1)]
+    """
+    e = 1
+    if n < 4 :
+        return n, e
+    t = ctz(n)
+    while True :
+        for p in small_primes(n.bit_length()) :
+            if t and t%p :
+                continue
+            if any( n%q and pow(n%q, (q-1)//p, q) != 1 for q in _power_moduli(p) ) :
+                continue
+            r = iroot(n, p)
+            if r**p == n :
+                n, e, t = r, e*p, t//p
+                break
+        else :
+            return n, e
 
 def is_prime(n) :
     """试除法判定素数，从2除至sqrt(n)。
@@ -84,8 +279,10 @@ def is_prime(n) :
             return False
     return True
 
-def factorize(n) :
-    """分解质因数，从2开始试除直至不能分解。（会产生非素数的因子吗？）
+def factorize(n, as_dict=False) :
+    """分解质因数，分级进行：先用perfect_power把n == b^e化为分解b，再用1000以内的素数试除一遍，余下的因子若是素数（is_primeM）即可收下，
+       是完全幂就开方后按重数记下，否则依次尝试MR_test给出的1的非平凡平方根、Pollard rho (Brent)、椭圆曲线法(ECM)把它一分为二，直至全部是素数。
+       返回从小到大排列的素因子列表，as_dict为真时返回{素数: 指数}的字典。
 
     >>> factorize(-1)
     []
@@ -97,33 +294,47 @@ def factorize(n) :
     [2, 2, 2, 2, 2, 2, 2, 2]
     >>> factorize(12345)
     [3, 5, 823]
+    >>> factorize(1000000007*998244353)
+    [998244353, 1000000007]
+    >>> factorize(2**64+1)
+    [274177, 67280421310721]
+    >>> factorize(720, as_dict=True)
+    {2: 4, 3: 2, 5: 1}
+    >>> factorize((2**89-1)**10, as_dict=True)
+    {618970019642690137449562111: 10}
+    >>> factorize(6*1000003**4*1000033**2, as_dict=True)
+    {2: 1, 3: 1, 1000003: 4, 1000033: 2}
     """
     res = []
-    while n>1 :
-        if n%2==0 :
-            res.append(2)
-            n //= 2
-            continue
-        elif n%3==0 :
-            res.append(3)
-            n //= 3
-            continue
-        for i in range(6, isqrt(n)+2, 6) :
-            if n%(i-1)==0 :
-                res.append(i-1)
-                n //= i-1
-                break
-            elif n%(i+1)==0 :
-                res.append(i+1)
-                n //= i+1
-                break
+    e = 1
+    if n >= 1000000 :
+        n, e = perfect_power(n)         # n == b^e时只分解b，最后每个因子重复e次
+    for p in _SMALL_PRIMES :
+        if p*p > n :
+            break
+        while n%p==0 :
+            res.append(p)
+            n //= p
+    rest = [(n, 1)] if n>1 else []      # (待分解的数, 重数)
+    while rest :
+        m, k = rest.pop()
+        if m < 1000000 or is_primeM(m) :   # 已除去1000以内的因子，小于1000^2即是素数
+            res += [m]*k
         else :
-            res.append(n)
-            n = 1
+            b, j = perfect_power(m)
+            if j > 1 :
+                rest.append( (b, k*j) )
+            else :
+                f = _split(m)
+                rest += [(f, k), (m//f, k)]
+    res *= e
+    res.sort()
+    if as_dict :
+        return dict( (p, res.count(p)) for p in sorted(set(res)) )
     return res
 
 def powermod(a, b, m) :
-    """幂模运算a^b%m，使用Montgomery快速算法对大指数求解。
+    """幂模运算a^b%m，由当前后端计算，纯Python的逐位平方累乘见_powermod_loop。
 
     >>> powermod(1234, 0, 10)
     1
@@ -132,12 +343,101 @@ def powermod(a, b, m) :
     >>> powermod(5, 5, 1000)
     125
     """
-    res = 1
-    while b>0 :
-        if b&1 :
-            res = a*res%m
-        a, b = a*a%m, b>>1
-    return res
+    return _powmod_impl(a, b, m)
+
+# --- 批量幂模 --------------------------------------------------------------
+try :
+    import numpy as np
+except ImportError :
+    np = None
+
+NUMPY_MIN = 64          # 至少这么多个元素且模数都小于2^32才走NumPy向量化路径
+
+def _window_plan(e) :
+    """指数e的滑动窗口分解（从高位到低位），返回[(平方次数, 奇数窗口值或0), ...]，所有底数共用。
+
+    >>> _window_plan(0b1011000101)
+    [(3, 5), (1, 1), (1, 0), (1, 0), (1, 0), (3, 5)]
+    """
+    bits = bin(e)[2:]
+    w = 1 if len(bits) <= 8 else 3 if len(bits) <= 64 else 4 if len(bits) <= 256 else 5
+    plan = []
+    i = 0
+    while i < len(bits) :
+        if bits[i] == '0' :
+            plan.append( (1, 0) )
+            i += 1
+        else :
+            j = min(i+w, len(bits))
+            while bits[j-1] == '0' :
+                j -= 1
+            plan.append( (j-i, int(bits[i:j], 2)) )
+            i = j
+    return plan
+
+def _np_fits(mods) :
+    return np is not None and len(mods) >= NUMPY_MIN and 0 < min(mods) and max(mods) < 1<<32
+
+def _np_reduce(a, m, mm) :
+    """把底数序列a按模数取余后转成uint64数组，a都小于2^64时直接在数组上取余。"""
+    if min(a) >= 0 and max(a) < 1<<64 :
+        return np.array(a, dtype=np.uint64) % mm
+    return ( np.array(a, dtype=object) % np.array(m, dtype=object) ).astype(np.uint64)
+
+def powermod_many(bases, exp, mod) :
+    """对一组底数计算a^exp%mod，mod可以是一个数，也可以是与bases等长的序列。
+       NumPy可用、元素足够多且模数都小于2^32时按滑动窗口整体计算：指数只分解一次，每个平方或乘法都是一次数组运算。
+       否则逐个调用内置的pow（内部也是滑动窗口）。返回列表。
+
+    >>> powermod_many([2, 3, 5], 340, 341)
+    [1, 56, 67]
+    >>> powermod_many([2, 3], 10, [1000, 7])
+    [24, 4]
+    >>> powermod_many(range(100), 65537, 4294967291) == [ pow(a, 65537, 4294967291) for a in range(100) ]
+    True
+    """
+    bases = list(bases)
+    mods = list(mod) if hasattr(mod, '__len__') else [mod]*len(bases)
+    if exp < 0 or not _np_fits(mods) :
+        return [ _powmod_impl(a, exp, m) for a,m in zip(bases, mods) ]
+    m = np.array(mods, dtype=np.uint64)
+    a = _np_reduce(bases, mods, m)
+    plan = _window_plan(exp)
+    table = {1: a}
+    a2 = a*a%m
+    for d in range(3, max(d for sq,d in plan)+1, 2) :
+        table[d] = table[d-2]*a2%m
+    res = np.ones_like(m) % m
+    for sq, d in plan :
+        for i in range(sq) :
+            res = res*res%m
+        if d :
+            res = res*table[d]%m
+    return res.tolist()
+
+def powermod_batch(a, e, m) :
+    """逐元素计算a[i]^e[i]%m[i]，三个序列等长，指数各不相同。
+       NumPy可用、元素足够多且模数都小于2^32时按二进制位整体推进：每一位一次数组平方和一次按掩码的乘法。
+       输入是NumPy数组且走了NumPy路径时返回uint64数组，否则返回列表。
+
+    >>> powermod_batch([2, 3, 5], [10, 4, 3], [1000, 100, 7])
+    [24, 81, 6]
+    >>> n = list(range(1000001, 1001001, 2))
+    >>> powermod_batch([2]*len(n), [ k-1 for k in n ], n) == [ pow(2, k-1, k) for k in n ]
+    True
+    """
+    arrays = np is not None and any( isinstance(x, np.ndarray) for x in (a, e, m) )
+    a, e, m = list(a), list(e), list(m)
+    if min(e, default=0) < 0 or not _np_fits(m) :
+        return [ _powmod_impl(x, y, z) for x,y,z in zip(a, e, m) ]
+    mm = np.array(m, dtype=np.uint64)
+    x = _np_reduce(a, m, mm)
+    y = np.array(e, dtype=np.uint64 if max(e, default=0) < 1<<64 else object)
+    res = np.ones_like(mm) % mm
+    for i in range(max(e, default=0).bit_length()) :
+        res = np.where(((y>>i)&1).astype(bool), res*x%mm, res)
+        x = x*x%mm
+    return res if arrays else res.tolist()
 
 def is_primeF(n) :
     """费马小定理进行素性测试，a^(p-1)==1 (mod p)。
@@ -165,7 +465,7 @@ def is_primeF(n) :
         return True
     elif (n&1)==0 :
         return False
-    return powermod(2, n-1, n)==1 and powermod(3, n-1, n)==1 and powermod(5, n-1, n)==1
+    return powermod_many((2, 3, 5), n-1, n) == [1, 1, 1]
 
 def ctz(n) :
     """所谓Count Trailing Zeros指令，返回整数n末尾0的个数（最低位1的位置）
@@ -186,6 +486,7 @@ def MR_test(a, n) :
        因(p-1)为偶数，令(p-1)=(2^s)*d，依次计算平方序列x = a^d,a^2d,a^4d...a^((2^s)*d) (mod p)，找到1即可知p通过费马测试。
        基于x^2==1 (mod p)只存在平凡的平方根（x==1、-1），进一步对p筛选：发现1(mod p)非平凡的平方根，则未通过Miller-Rabin测试。
        返回值: 未通过费马测试返回0，a^d==1或-1返回1，发现x^2==-1(mod p)返回x==SQRT(-1)，发现x^2==1(mod p)返回-x==-SQRT(1)。
+       x是1的非平凡平方根时(x-1)(x+1)==0 (mod p)，gcd(x-1, p)就是p的一个真因子，factorize以此做第一步分解。
 
     >>> MR_test(2, 341)
     -32
@@ -225,17 +526,139 @@ def MR_test(a, n) :
         else :
             return 0
 
+_SMALL_PRIMES = [ p for p in range(1000) if is_prime(p) ]
+_SMALL_PRIMES_SET = frozenset(_SMALL_PRIMES)
+_PRIMORIAL = reduce(lambda x,y:x*y, _SMALL_PRIMES)
+_MR_BASES = (       # 已知n小于上界时，取这些底数的Miller Rabin测试是确定性的
+    (2047,                  (2, )),
+    (1373653,               (2, 3)),
+    (25326001,              (2, 3, 5)),
+    (3215031751,            (2, 3, 5, 7)),
+    (2152302898747,         (2, 3, 5, 7, 11)),
+    (3474749660383,         (2, 3, 5, 7, 11, 13)),
+    (341550071728321,       (2, 3, 5, 7, 11, 13, 17)),
+    (3825123056546413051,   (2, 3, 5, 7, 11, 13, 17, 19, 23)),
+)
+
 def is_primeM(n) :
-    if n<2 :
+    """Miller Rabin素性测试。先与小素数之积求一次gcd筛掉有小因子的合数（小于1000^2的数到此即有定论），
+       再按n的大小选取已知确定性的底数组；超出底数表的n（含2^64以上）做BPSW测试（底数2的强伪素数测试加强Lucas测试），
+       BPSW对2^64以下确定无误，更大的数尚未发现反例。
+
+    >>> is_primeM(1)
+    False
+    >>> is_primeM(997)
+    True
+    >>> is_primeM(25326001)
+    False
+    >>> is_primeM(3215031751)
+    False
+    >>> is_primeM(2**61-1)
+    True
+    >>> is_primeM(18446744073709551557)
+    True
+    >>> is_primeM(2**89-1)
+    True
+    >>> is_primeM((2**89-1)*(2**61-1))
+    False
+    """
+    if n<1000 :
+        return n in _SMALL_PRIMES_SET
+    elif gcd(n, _PRIMORIAL) != 1 :
         return False
-    elif n==2 or n==3 or n==5 :
+    elif n < 1000000 :
         return True
-    elif (n&1)==0 :
-        return False
-    return MR_test(2, n)>0 and MR_test(3, n)>0 and MR_test(5, n)>0
+    d = n-1
+    s = ctz(d)
+    d >>= s
+    for bound, bases in _MR_BASES :
+        if n < bound :
+            break
+    else :
+        return _bpsw_impl(n)
+    for a in bases :
+        if not _sprp(n, d, s, a) :
+            return False
+    return True
+
+def _sprp(n, d, s, a) :
+    """底数a的强伪素数测试，n-1 == d*2^s，d为奇数。"""
+    x = _powmod_impl(a, d, n)
+    if x==1 or x==n-1 :
+        return True
+    for i in range(1, s) :
+        x = x*x%n
+        if x==n-1 :
+            return True
+        elif x==1 :
+            return False
+    return False
+
+def jacobi(a, n) :
+    """Jacobi符号(a/n)，n为正奇数。
+
+    >>> jacobi(2, 7)
+    1
+    >>> jacobi(5, 21)
+    1
+    >>> jacobi(3, 7)
+    -1
+    >>> jacobi(7, 21)
+    0
+    """
+    a %= n
+    res = 1
+    while a :
+        while a&1 == 0 :
+            a >>= 1
+            if n&7 in (3, 5) :
+                res = -res
+        a, n = n, a
+        if a&3 == 3 and n&3 == 3 :
+            res = -res
+        a %= n
+    return res if n==1 else 0
+
+def _lucas_sprp(n) :
+    """强Lucas伪素数测试（Selfridge取参数：D为5,-7,9,-11...中首个满足(D/n)==-1者，P=1，Q=(1-D)/4）。
+       n为大于3的奇数。n+1 == d*2^s，n通过测试当U_d==0，或某个V_(d*2^r)==0 (0<=r<s)。
+    """
+    D = 5
+    while True :
+        j = jacobi(D, n)
+        if j == -1 :
+            break
+        elif j == 0 and abs(D) != n :
+            return False
+        D = -D-2 if D>0 else -D+2
+        if D == -15 and isqrt(n)**2 == n :     # 完全平方数找不到这样的D
+            return False
+    Q = (1-D)//4
+    d = n+1
+    s = ctz(d)
+    d >>= s
+    U, V, Qk = 1, 1, Q%n
+    for bit in bin(d)[3:] :
+        U, V = U*V%n, (V*V-2*Qk)%n
+        Qk = Qk*Qk%n
+        if bit == '1' :
+            U, V = U+V, D*U+V
+            U = (U if U&1==0 else U+n)>>1
+            V = (V if V&1==0 else V+n)>>1
+            U, V = U%n, V%n
+            Qk = Qk*Q%n
+    if U==0 or V==0 :
+        return True
+    for r in range(1, s) :
+        V = (V*V-2*Qk)%n
+        if V==0 :
+            return True
+        Qk = Qk*Qk%n
+    return False
 
-def repunit_prime(s, n) :
+def repunit_prime(s, n, workers=None, checkpoint=None) :
     """因为循环节不是1和循环次数非素数的循环整数一定是合数，这个函数寻找循环次数少于n的形如001001...这样的素数。
+       搜索由repunit_search完成，每找到一个就立即打印。
 
     >>> repunit_prime('1', 500)
     {1, 2}
@@ -243,13 +666,450 @@ def repunit_prime(s, n) :
     {1, 23}
     {1, 317}
     """
-    if is_primeF( int(s*2) ) :
-        print('{%s, %d}'%(s, 2))
-    for i in range(6, n, 6) :
-        if is_primeF( int(s*(i-1)) ) :
-            print('{%s, %d}'%(s, i-1))
-        if is_primeF( int(s*(i+1)) ) :
-            print('{%s, %d}'%(s, i+1))
+    for k in repunit_search(s, n, workers, checkpoint) :
+        print('{%s, %d}'%(s, k))
+
+# --- 循环素数搜索 ----------------------------------------------------------
+import os
+import json
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+def _repunits(s, ks) :
+    """依次产出(k, s重复k次的整数)。用递推R(k+d) = R(k)*B^d + R(d)（B=10^len(s)）逐个构造，不必反复解析长字符串。"""
+    a, B = int(s), 10**len(s)
+    R, k = 0, 0
+    steps = {}
+    for k1 in ks :
+        d = k1-k
+        if d not in steps :
+            steps[d] = ( B**d, a*(B**d-1)//(B-1) )
+        R, k = R*steps[d][0] + steps[d][1], k1
+        yield k, R
+
+def _repunit_test(test, k, R) :
+    return k, test(R)
+
+def repunit_search(s, n, workers=None, checkpoint=None, test=is_primeF) :
+    """列出(generator)循环次数k少于n、形如s重复k次的素数的循环次数k，按k从小到大产出。
+       只检验k==2和6i±1，候选数用进程池并行做素性测试test，同时在途的任务不超过进程数的4倍，内存不随n增长。
+       workers为进程数，缺省为CPU个数，0或1则在本进程内串行。
+       checkpoint为断点文件名，记录已检验过的最大k和已找到的结果（找到结果时及每隔10秒更新），中断后以同样参数再次调用即从断点继续（已找到的少于n的结果会重新产出）。
+
+    >>> list(repunit_search('1', 100, workers=1))
+    [2, 19, 23]
+    >>> list(repunit_search('3', 30, workers=1))
+    []
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'R1.json')
+    >>> list(repunit_search('1', 100, workers=1, checkpoint=path)), list(repunit_search('1', 20, workers=1, checkpoint=path))
+    ([2, 19, 23], [2, 19])
+    """
+    state = {'s': s, 'checked': 0, 'found': []}
+    if checkpoint and os.path.exists(checkpoint) :
+        with open(checkpoint, encoding='utf-8') as f :
+            saved = json.load(f)
+        if saved['s'] != s :
+            raise ValueError('checkpoint is for another repunit', saved['s'])
+        state = saved
+    yield from ( k for k in state['found'] if k < n )
+
+    def save() :
+        if checkpoint :
+            with open(checkpoint+'.tmp', 'w', encoding='utf-8') as f :
+                json.dump(state, f)
+            os.replace(checkpoint+'.tmp', checkpoint)
+
+    def lengths() :
+        yield 2
+        for i in range(6, n, 6) :
+            yield i-1
+            yield i+1
+    ks = ( k for k in lengths() if k > state['checked'] )
+    workers = workers if workers is not None else os.cpu_count()
+    if workers <= 1 :
+        results = ( (k, test(R)) for k, R in _repunits(s, ks) )
+    else :
+        results = _pool_map(workers, test, _repunits(s, ks))
+    last = time.monotonic()
+    for k, ok in results :
+        state['checked'] = k
+        if ok :
+            state['found'].append(k)
+        if ok or time.monotonic()-last > 10 :    # 找到结果或每隔10秒写一次断点
+            save()
+            last = time.monotonic()
+        if ok :
+            yield k
+    save()
+
+def _pool_map(workers, test, candidates) :
+    """按提交顺序产出进程池的检验结果，在途任务数有上限。"""
+    with ProcessPoolExecutor(workers) as pool :
+        pending = deque()
+        for k, R in candidates :
+            pending.append( pool.submit(_repunit_test, test, k, R) )
+            if len(pending) >= 4*workers :
+                yield pending.popleft().result()
+        while pending :
+            yield pending.popleft().result()
+
+# --- 分段筛 ----------------------------------------------------------------
+
+SEGMENT = 1<<16         # 每段筛的奇数个数，决定分段筛的内存占用
+BASE_LIMIT = 1<<22      # 筛法所需基素数的上限，超过BASE_LIMIT^2的数逐个判断
+DENSE = 16              # 一段之内待判断的数不少于DENSE个才值得筛
+
+def small_primes(n) :
+    """埃拉托斯特尼筛法，返回不超过n的全部素数。只对奇数筛，sieve[i]对应2i+1。
+
+    >>> small_primes(1)
+    []
+    >>> small_primes(2)
+    [2]
+    >>> small_primes(30)
+    [2, 3, 5, 7, 11, 13, 17, 19, 23, 29]
+    """
+    if n<2 :
+        return []
+    sieve = bytearray([1])*((n+1)//2)
+    sieve[0] = 0
+    for i in range(1, (isqrt(n)+1)//2) :
+        if sieve[i] :
+            p = 2*i+1
+            sieve[p*p//2::p] = bytes(len(range(p*p//2, len(sieve), p)))
+    return [2] + list(compress(range(1, n+1, 2), sieve))
+
+_base = [2]             # 缓存的基素数，按需增长
+def _base_primes(n) :
+    """返回不超过n的奇素数（基素数），缓存不够时按倍增重新筛。"""
+    global _base
+    if _base[-1] < n :
+        _base = small_primes(max(n, 2*_base[-1]))
+    return _base[1:bisect_right(_base, n)]
+
+def _segments(lo, hi) :
+    """把区间[lo, hi)切成若干段逐段筛，产出(start, seg)：start为奇数，seg[i]非零表示start+2i是素数。
+       每个基素数p从max(p*p, 段首)处的第一个奇倍数开始划掉，步长p在奇数下标上正好对应2p。
+    """
+    start = max(lo, 1)|1
+    if start >= hi :
+        return
+    base = _base_primes(isqrt(hi-1))
+    zero = memoryview(bytes(SEGMENT//3+1))
+    while start < hi :
+        end = min(start + 2*SEGMENT, hi)
+        n = (end-start+1)>>1
+        seg = bytearray([1])*n
+        for p in base :
+            q = p*p
+            if q >= end :
+                break
+            elif q < start :
+                q = start + (-start)%p
+                if not q&1 :
+                    q += p
+            i = (q-start)>>1
+            if i < n :
+                seg[i::p] = zero[:(n-1-i)//p+1]
+        if start == 1 :
+            seg[0] = 0
+        yield start, seg
+        start = end|1
+
+def primes_in_range(lo, hi) :
+    """列出(generator)区间[lo, hi)内的全部素数。
+
+    >>> list(primes_in_range(0, 20))
+    [2, 3, 5, 7, 11, 13, 17, 19]
+    >>> list(primes_in_range(1000000000, 1000000100))
+    [1000000007, 1000000009, 1000000021, 1000000033, 1000000087, 1000000093, 1000000097]
+    """
+    if lo <= 2 < hi :
+        yield 2
+    for start, seg in _segments(lo, hi) :
+        yield from compress(range(start, start+2*len(seg), 2), seg)
+
+def prime_count(hi) :
+    """统计小于hi的素数个数。
+
+    >>> prime_count(2)
+    0
+    >>> prime_count(3)
+    1
+    >>> prime_count(100)
+    25
+    """
+    return (hi > 2) + sum(seg.count(1) for start, seg in _segments(2, hi))
+
+def is_prime_many(values) :
+    """批量素性判断，按输入顺序返回布尔值列表。
+       把待判断的数排序去重后按段归并，一段之内足够密集就筛一次整段，否则逐个判断。
+
+    >>> is_prime_many(range(10))
+    [False, False, True, True, False, True, False, True, False, False]
+    >>> sum(is_prime_many(range(10**6, 2*10**6)))
+    70435
+    """
+    values = list(values)
+    todo = sorted(set( v for v in values if v > 2 and v&1 ))
+    found = set()
+    i = 0
+    while i < len(todo) :
+        lo = todo[i]
+        hi = min(lo + 2*SEGMENT, todo[-1]+1)
+        j = bisect_left(todo, hi, i)
+        if j-i >= DENSE and hi <= BASE_LIMIT**2 :
+            for start, seg in _segments(lo, hi) :
+                found.update( v for v in todo[i:j] if seg[(v-start)>>1] )
+        else :
+            found.update( v for v in todo[i:j] if is_primeM(v) )
+        i = j
+    return [ v == 2 or v in found for v in values ]
+
+# --- 素数计数 --------------------------------------------------------------
+
+def prime_pi(x) :
+    """统计不超过x的素数个数π(x)，Lucy_Hedgehog算法，时间约O(x^(3/4))，内存O(sqrt(x))。
+       只需要S(v) = #{不超过v的素数}在v = x//i这2sqrt(x)个点上的值，初值S(v) = v-1（2..v全部计入），
+       对每个素数p <= sqrt(x)，划掉最小素因子为p的合数：S(v) -= S(v//p) - S(p-1)，v从大到小，v >= p*p。
+       small[v]存v <= sqrt(x)处的值，large[i]存x//i处的值；NumPy可用时每个p的更新是两次数组运算。
+
+    >>> [ prime_pi(x) for x in (0, 1, 2, 3, 10, 100) ]
+    [0, 0, 1, 2, 4, 25]
+    >>> prime_pi(10**6) == prime_count(10**6+1)
+    True
+    >>> prime_pi(10**9)
+    50847534
+    """
+    if x < 2 :
+        return 0
+    r = isqrt(x)
+    if np is not None and x < 1<<62 :
+        return int(_lucy_np(x, r))
+    small = [0] + [ v-1 for v in range(1, r+1) ]
+    large = [0] + [ x//i-1 for i in range(1, r+1) ]
+    for p in small_primes(r) :
+        sp, p2 = small[p-1], p*p
+        n = min(r, x//p2)
+        k = min(n, r//p)            # i <= k时x//(i*p)仍在large里
+        for i in range(1, k+1) :
+            large[i] -= large[i*p] - sp
+        for i in range(k+1, n+1) :
+            large[i] -= small[x//(i*p)] - sp
+        for v in range(r, p2-1, -1) :
+            small[v] -= small[v//p] - sp
+    return large[1]
+
+def _lucy_np(x, r) :
+    """prime_pi的NumPy版本，右边整体取旧值，与逐个从大到小更新的结果相同。"""
+    idx = np.arange(r+1, dtype=np.int64)
+    small = idx - 1
+    small[0] = 0
+    large = x // np.maximum(idx, 1) - 1
+    for p in small_primes(r) :
+        sp, p2 = int(small[p-1]), p*p
+        n = min(r, x//p2)
+        k = min(n, r//p)
+        rhs = np.empty(n, dtype=np.int64)
+        rhs[:k] = large[p:k*p+1:p]
+        rhs[k:] = small[x // (idx[k+1:n+1]*p)]
+        large[1:n+1] -= rhs - sp
+        if p2 <= r :
+            small[p2:] -= small[idx[p2:]//p] - sp
+    return large[1]
+
+def nth_prime(k) :
+    """第k个素数（从1开始计）。先用Cipolla渐近式估计位置g，prime_pi(g)校正：
+       估计偏大就退回，直到π(g) < k，再从g+1起分段筛，数到第k个为止，筛的区间只是估计误差那么长。
+
+    >>> [ nth_prime(k) for k in range(1, 11) ]
+    [2, 3, 5, 7, 11, 13, 17, 19, 23, 29]
+    >>> nth_prime(10**6)
+    15485863
+    >>> nth_prime(10**8)
+    2038074743
+    """
+    if k < 1 :
+        raise ValueError('k must be positive')
+    if k < 6 :
+        return (2, 3, 5, 7, 11)[k-1]
+    from math import log
+    L, LL = log(k), log(log(k))
+    g = int(k*(L + LL - 1 + (LL-2)/L - (LL*LL - 6*LL + 11)/(2*L*L)))
+    c = prime_pi(g)
+    while c >= k :
+        g = max(1, g - int((c-k+1)*log(g)*1.5) - 100)
+        c = prime_pi(g)
+    hi = int(k*(L + LL)) + 1          # k >= 6时第k个素数小于k(ln k + ln ln k)
+    for p in primes_in_range(g+1, hi) :
+        c += 1
+        if c == k :
+            return p
+
+# --- 因子分解 --------------------------------------------------------------
+
+def _split(n) :
+    """把没有小因子的奇合数n分成两个真因子的乘积，返回其中之一。"""
+    for a in (2, 3, 5, 7, 11) :
+        r = MR_test(a, n)
+        if r < 0 :              # -r是1的非平凡平方根
+            return gcd(-r-1, n)
+    for c in (1, 3, 5) :
+        f = pollard_rho(n, c, 1<<16)
+        if f :
+            return f
+    curves = ecm_curves()
+    for B1, count in ECM_SCHEDULE :
+        f = ecm(n, B1, count, curves)
+        if f :
+            return f
+    while True :
+        B1 *= 4
+        f = ecm(n, B1, count, curves)
+        if f :
+            return f
+
+def pollard_rho(n, c=1, limit=1<<20) :
+    """Pollard rho分解（Brent改进），迭代y <- y^2+c (mod n)，累乘|x-y|若干次才求一次gcd。
+       找到真因子则返回，迭代超过limit步或失败返回None。
+
+    >>> pollard_rho(8051)
+    97
+    >>> pollard_rho(10403)
+    101
+    """
+    y, r, q, g = 2, 1, 1, 1
+    m = 128
+    while g == 1 :
+        x = y
+        for i in range(r) :
+            y = (y*y+c)%n
+        k = 0
+        while k < r and g == 1 :
+            ys = y
+            for i in range(min(m, r-k)) :
+                y = (y*y+c)%n
+                q = q*(x-y)%n
+            g = gcd(q, n)
+            k += m
+        r <<= 1
+        if r > limit and g == 1 :
+            return None
+    if g == n :                 # 累乘越过了因子，从ys逐步回溯
+        while True :
+            ys = (ys*ys+c)%n
+            g = gcd(x-ys, n)
+            if g > 1 :
+                break
+    return g if g != n else None
+
+ECM_SCHEDULE = (        # (B1, 曲线数)，分别针对约15、20、25、30、35位的因子
+    (2000,      25),
+    (11000,     90),
+    (50000,     300),
+    (250000,    700),
+    (1000000,   1800),
+)
+
+def ecm_curves(sigma=6) :
+    """生成Suyama参数化的曲线参数sigma = 6, 7, 8...，在ecm的多次调用之间共享以免重复尝试同一条曲线。"""
+    while True :
+        yield sigma
+        sigma += 1
+
+_lcm_cache = {}
+def _lcm_upto(B) :
+    """1..B的最小公倍数，即ECM第一阶段的乘数。"""
+    if B not in _lcm_cache :
+        k = 1
+        for p in small_primes(B) :
+            pp = p
+            while pp*p <= B :
+                pp *= p
+            k *= pp
+        _lcm_cache[B] = k
+    return _lcm_cache[B]
+
+def _xdbl(X, Z, a24, n) :
+    t1 = (X+Z)*(X+Z)%n
+    t2 = (X-Z)*(X-Z)%n
+    t3 = t1-t2
+    return t1*t2%n, t3*(t2+a24*t3)%n
+
+def _xadd(XP, ZP, XQ, ZQ, XD, ZD, n) :
+    u = (XP-ZP)*(XQ+ZQ)
+    v = (XP+ZP)*(XQ-ZQ)
+    return ZD*(u+v)*(u+v)%n, XD*(u-v)*(u-v)%n
+
+def _ladder(k, X, Z, a24, n) :
+    """Montgomery阶梯，计算射影坐标下的k*(X:Z)。"""
+    if k == 1 :
+        return X, Z
+    X0, Z0 = X, Z
+    X1, Z1 = _xdbl(X, Z, a24, n)
+    for bit in bin(k)[3:] :
+        if bit == '1' :
+            X0, Z0 = _xadd(X1, Z1, X0, Z0, X, Z, n)
+            X1, Z1 = _xdbl(X1, Z1, a24, n)
+        else :
+            X1, Z1 = _xadd(X0, Z0, X1, Z1, X, Z, n)
+            X0, Z0 = _xdbl(X0, Z0, a24, n)
+    return X0, Z0
+
+def ecm(n, B1, count, curves=None) :
+    """Lenstra椭圆曲线分解，Montgomery曲线，第一阶段乘以lcm(1..B1)，第二阶段B2=100*B1用差分表逐个素数累乘。
+       尝试count条曲线，找到真因子则返回，否则返回None。
+
+    >>> ecm(1000000007*998244353, 2000, 10)
+    998244353
+    """
+    curves = curves if curves else ecm_curves()
+    B2 = 100*B1
+    B = B1-1 if B1&1==0 else B1
+    D = min(isqrt(B2)>>1, (B-1)>>1)
+    k = _lcm_upto(B1)
+    for i in range(count) :
+        sigma = next(curves)
+        u = (sigma*sigma-5)%n
+        v = 4*sigma%n
+        X, Z = pow(u, 3, n), pow(v, 3, n)
+        t = 16*pow(u, 3, n)*v%n         # a24 = (A+2)/4 = (v-u)^3*(3u+v) / (16*u^3*v)
+        g = gcd(t, n)
+        if g != 1 :
+            if g != n :
+                return g
+            continue
+        a24 = pow(v-u, 3, n)*(3*u+v)*pow(t, -1, n)%n
+        X, Z = _ladder(k, X, Z, a24, n)
+        g = gcd(Z, n)
+        if g != 1 :
+            if g != n :
+                return g
+            continue
+        # 第二阶段：S[d] = 2d*Q，R = r*Q，r从奇数B开始每次加2D，r < q <= r+2D的素数q == r+2d
+        S = [None, _xdbl(X, Z, a24, n)]
+        S.append( _xdbl(*S[1], a24, n) )
+        for d in range(3, D+1) :
+            S.append( _xadd(*S[d-1], *S[1], *S[d-2], n) )
+        beta = [ None if s is None else s[0]*s[1]%n for s in S ]
+        T = _ladder(B-2*D, X, Z, a24, n)
+        R = _ladder(B, X, Z, a24, n)
+        primes = primes_in_range(B+1, B2+1)
+        q = next(primes)
+        acc = 1
+        for r in range(B, B2, 2*D) :
+            alpha = R[0]*R[1]%n
+            while q <= r+2*D :
+                XS, ZS = S[(q-r)>>1]
+                acc = acc*((R[0]-XS)*(R[1]+ZS)-alpha+beta[(q-r)>>1])%n
+                q = next(primes, B2+2*D+1)
+            R, T = _xadd(*R, *S[D], *T, n), R
+        g = gcd(acc, n)
+        if g != 1 and g != n :
+            return g
+    return None
 
 
 if __name__ == "__main__":
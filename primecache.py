@@ -0,0 +1,148 @@
+# primecache.py
+#
+# version 0.1
+
+"""\
+素数表与因子缓存。反复对相近的数做素数判断和分解质因数时，用最小素因子表(SPF)和LRU缓存避免重复计算。
+
+limit以内的数查最小素因子表，O(log n)即可分解；更大的数交给prime.factorize和prime.is_primeM，结果放进有界的LRU缓存。
+
+>>> fc = FactorCache(1000)
+>>> fc.factorize(360)
+[2, 2, 2, 3, 3, 5]
+>>> fc.is_prime(997)
+True
+>>> fc.factorize(1000000007*998244353)
+[998244353, 1000000007]
+>>> fc.factorize(1000000007*998244353)
+[998244353, 1000000007]
+>>> st = fc.stats()
+>>> st['table_hits'], st['factor_hits'], st['factor_misses']
+(2, 1, 1)
+
+最小素因子表可以保存成文件，以内存映射的方式载入，多个工作进程共享同一份物理内存而不必各自重建：
+
+>>> import os, tempfile
+>>> path = os.path.join(tempfile.mkdtemp(), 'spf.bin')
+>>> FactorCache(10**5, path).factorize(99991*3)
+[3, 99991]
+>>> FactorCache(10**5, path).stats()['mapped']
+True
+
+缓存文件为空或残缺时当作不存在，重建后覆盖：
+
+>>> open(path, 'wb').close()
+>>> load_spf(path) is None, FactorCache(10**5, path).stats()['mapped']
+(True, False)
+>>> FactorCache(10**5, path).stats()['mapped']
+True
+"""
+
+import os
+import sys
+import mmap
+import struct
+from array import array
+from functools import lru_cache
+
+import prime
+
+MAGIC = b'SPF1' + (b'L' if sys.byteorder == 'little' else b'B')
+HEADER = struct.Struct('=5sxxxQ')       # 魔数、字节序、limit，其后是uint32数组
+
+def build_spf(limit) :
+    """计算奇数的最小素因子表，spf[i]对应2i+1，为0表示2i+1是素数（1除外）。
+       从大到小遍历不超过sqrt(limit)的素数，整段切片赋值划掉p*p起的奇倍数，小素数后写而覆盖大素数，留下的就是最小素因子。
+
+    >>> build_spf(30).tolist()
+    [0, 0, 0, 0, 3, 0, 0, 3, 0, 0, 3, 0, 5, 3, 0, 0]
+    """
+    spf = array('I', bytes(4*(limit//2+1)))
+    for p in reversed(prime.small_primes(prime.isqrt(limit))[1:]) :
+        start = p*p//2
+        spf[start::p] = array('I', [p])*len(range(start, len(spf), p))
+    return spf
+
+def save_spf(path, spf, limit) :
+    """把最小素因子表写入文件，先写临时文件再改名，并发的进程不会读到半个文件。"""
+    with open(path+'.tmp', 'wb') as f :
+        f.write(HEADER.pack(MAGIC, limit))
+        spf.tofile(f)
+    os.replace(path+'.tmp', path)
+
+def load_spf(path) :
+    """以只读内存映射载入最小素因子表，返回(limit, 按uint32解释的memoryview)；文件不合格式返回None。"""
+    with open(path, 'rb') as f :
+        if os.fstat(f.fileno()).st_size < HEADER.size :     # 空文件不能映射
+            return None
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, limit = HEADER.unpack_from(mm)
+    if magic != MAGIC or len(mm) != HEADER.size + 4*(limit//2+1) :
+        return None
+    return limit, memoryview(mm)[HEADER.size:].cast('I')
+
+class FactorCache :
+    """带缓存的素数判断与分解质因数。
+       limit以内查最小素因子表；path给出时表从该文件映射载入，文件不存在或比limit小就重建并保存。
+       limit以上的结果各自存入容量为maxsize的LRU缓存，stats()报告命中情况以便调整容量。
+    """
+    def __init__(self, limit=1<<20, path=None, maxsize=4096) :
+        loaded = load_spf(path) if path and os.path.exists(path) else None
+        if loaded and loaded[0] >= limit :
+            self.limit, self.spf = loaded
+            self.mapped = True
+        else :
+            self.limit, self.spf = limit, build_spf(limit)
+            self.mapped = False
+            if path :
+                save_spf(path, self.spf, limit)
+        self.table_hits = 0
+        self._factor = lru_cache(maxsize)(lambda n:tuple(prime.factorize(n)))
+        self._prime = lru_cache(maxsize)(prime.is_primeM)
+
+    def is_prime(self, n) :
+        if n <= self.limit :
+            self.table_hits += 1
+            return n==2 or (n>2 and n&1==1 and self.spf[n>>1]==0)
+        return self._prime(n)
+
+    def factorize(self, n, as_dict=False) :
+        """与prime.factorize相同的结果格式。"""
+        if n <= self.limit :
+            self.table_hits += 1
+            res = self._factor_small(n)
+        else :
+            res = list(self._factor(n))
+        if as_dict :
+            return dict( (p, res.count(p)) for p in sorted(set(res)) )
+        return res
+
+    def _factor_small(self, n) :
+        res = []
+        if n < 2 :
+            return res
+        c = prime.ctz(n)
+        res += [2]*c
+        n >>= c
+        spf = self.spf
+        while n > 1 :
+            p = spf[n>>1] or n
+            res.append(p)
+            n //= p
+        return res
+
+    def stats(self) :
+        """命中统计：表内查询次数，以及两个LRU缓存各自的命中、未命中次数和当前大小。"""
+        fi, pi = self._factor.cache_info(), self._prime.cache_info()
+        return {
+            'limit'         : self.limit,
+            'mapped'        : self.mapped,
+            'table_hits'    : self.table_hits,
+            'factor_hits'   : fi.hits,
+            'factor_misses' : fi.misses,
+            'factor_size'   : fi.currsize,
+            'prime_hits'    : pi.hits,
+            'prime_misses'  : pi.misses,
+            'prime_size'    : pi.currsize,
+            'maxsize'       : fi.maxsize,
+        }
@@ -12,29 +12,154 @@
 >>> ss = '(define (fib n) (cond ((= n 0) 1) (else (* n (fib (- n 1)))) )) (fib 5)'
 >>> SxParser.toString(Interp0().evals(SxParser.fromString( ss )))
 '120'
+
+表达式先由Interp0.compile编译成指令序列（Code），符号解析成帧内位置或全局Cell，再由栈式虚拟机执行：
+
+>>> SxParser.toString(Interp0().evals(SxParser.fromString( '(let ((x 2) (y 3)) (* x y))' )))
+'6'
+
+if、and、or是短路求值的特殊形式，算术、比较和表操作是原生的内置函数：
+
+>>> SxParser.toString(Interp0().evals(SxParser.fromString( '(if (>= 2 1) (cons 1 (list 2 3)) (car ()))' )))
+'(1 2 3)'
+
+表由cons单元(Pair)串成，cons、cdr不复制，逐个cons出长表是线性的：
+
+>>> ss = '(define (build n acc) (if (= n 0) acc (build (- n 1) (cons n acc)))) (length (cdr (build 20000 ())))'
+>>> SxParser.toString(Interp0().evals(SxParser.fromString( ss )))
+'19999'
+
+尾调用不占用帧栈，尾递归写成的迭代过程可以运行任意多步；非尾递归的深度由max_depth限制：
+
+>>> ss = '(define (loop n acc) (cond ((= n 0) acc) (else (loop (- n 1) (+ acc 1))))) (loop 100000 0)'
+>>> SxParser.toString(Interp0(max_depth=10).evals(SxParser.fromString( ss )))
+'100000'
+>>> ss = '(define (sum n) (cond ((= n 0) 0) (else (+ n (sum (- n 1)))))) (sum 100000)'
+>>> SxParser.toString(Interp0().evals(SxParser.fromString( ss )))
+'5000050000'
+>>> Interp0(max_depth=1000).evals(SxParser.fromString( ss ))
+Traceback (most recent call last):
+    ...
+r0rs.RuntimeError: ('recursion too deep', 1000)
+
+define-memo定义的函数按参数值缓存结果（LRU淘汰，容量由memo_size给出），memo_stats()报告命中率：
+
+>>> intp = Interp0(memo_size=100)
+>>> ss = '(define-memo (fib n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2))))) (fib 80)'
+>>> SxParser.toString(intp.evals(SxParser.fromString( ss )))
+'23416728348467685'
+>>> intp.memo_stats()
+[{'name': 'fib', 'size': 81, 'maxsize': 100, 'hits': 78, 'misses': 81, 'hit_rate': 0.49}]
+
+define-memo函数的每层调用占一个帧，同样受max_depth限制；返回值要经返回点存入缓存，所以尾调用也占一层：
+
+>>> ss = '(define-memo (sum n) (if (= n 0) 0 (+ n (sum (- n 1))))) (sum 999)'
+>>> SxParser.toString(Interp0(max_depth=1000).evals(SxParser.fromString( ss )))
+'499500'
+>>> ss = '(define-memo (loop n) (if (= n 0) 0 (loop (- n 1)))) (loop 100000)'
+>>> Interp0(max_depth=1000).evals(SxParser.fromString( ss ))
+Traceback (most recent call last):
+    ...
+r0rs.RuntimeError: ('recursion too deep', 1000)
+
+Interp0(profile=True)打开性能统计，按函数记录调用次数和累计时间、最深的递归和分配的调用帧数：
+
+>>> intp = Interp0(profile=True)
+>>> ss = '(define (sum n) (if (= n 0) 0 (+ n (sum (- n 1))))) (sum 100)'
+>>> SxParser.toString(intp.evals(SxParser.fromString( ss )))
+'5050'
+>>> st = intp.prof.stats()
+>>> st['calls']['sum'], st['calls']['+'], st['max_depth'], st['frames']
+(101, 100, 101, 101)
+
+全局环境和编译好的代码可以存成映像文件，下次直接载入而不必重新解析、编译；fork()从冻结的环境廉价地复制出新的解释器：
+
+>>> import os, tempfile
+>>> path = os.path.join(tempfile.mkdtemp(), 'sq.r0i')
+>>> intp = Interp0()
+>>> code = Interp0.compile(SxParser.fromString( '(define (sq x) (* x x))' )[0], intp.env)
+>>> save_image(path, intp, [code], b'key')
+>>> intp2, codes = load_image(path, b'key')
+>>> intp2.execute(codes[0]) is None, SxParser.toString(intp2.eval(SxParser.fromString( '(sq 12)' )[0]))
+(True, '144')
+>>> load_image(path, b'other') is None
+True
+>>> intp3 = intp2.fork()
+>>> intp3.evals(SxParser.fromString( '(define (sq x) 0)' ))
+>>> SxParser.toString(intp2.eval(SxParser.fromString( '(sq 3)' )[0])), SxParser.toString(intp3.eval(SxParser.fromString( '(sq 3)' )[0]))
+('9', '0')
+
+复制出的环境里，已定义的函数引用的也是复制后的全局变量：
+
+>>> a = Interp0()
+>>> a.evals(SxParser.fromString( '(define (h) 1) (define (g) (h))' ))
+>>> b = a.fork()
+>>> b.evals(SxParser.fromString( '(define (h) 2)' ))
+>>> a.evals(SxParser.fromString( '(define (h) 3)' ))
+>>> SxParser.toString(a.eval(SxParser.fromString( '(g)' )[0])), SxParser.toString(b.eval(SxParser.fromString( '(g)' )[0]))
+('3', '2')
+
+intp.limit限制单次求值的步数（lambda调用次数）和时间，用于执行不可信的程序：
+
+>>> intp = Interp0()
+>>> intp.limit = Limit(steps=1000)
+>>> intp.evals(SxParser.fromString( '(define (spin) (spin)) (spin)' ))
+Traceback (most recent call last):
+    ...
+r0rs.RuntimeError: ('step limit exceeded', 1000)
 """
 
 # --- Interpreter -----------------------------------------
-from functools import reduce
+import copy
+import time
+import operator
+import weakref
 from enum import Enum
+from collections import OrderedDict
 
 T = Enum('T', 'STRING INT FLOAT BOOL BUILTIN LAMBDA KEYWORD SYMBOL')
 
 class ATOM :
-    """S表达式(S-expression)是原子、空列表或S表达式的列表。"""
+    """S表达式(S-expression)是原子、空列表或S表达式的列表。
+       原子只有kind、value两个槽；符号、关键字、#t #f和小整数经ATOM.make或ATOM.pack取得的是共享的单例，可以用is比较。
+       pickle时这几类原子经ATOM.make重建，载入后仍是单例。"""
+    __slots__ = ('kind', 'value')
+    def make(kind, value) :
+        if kind is T.SYMBOL :
+            atom = _symbols.get(value)
+            if atom is None :
+                atom = _symbols[value] = ATOM(kind, value)
+            return atom
+        elif kind is T.INT or kind is T.BOOL :
+            return ATOM.pack(value)
+        elif kind is T.KEYWORD :
+            return KEYWORDS[value]
+        return ATOM(kind, value)
     def pack(value) :
-        if type(value) == str :
-            return ATOM(T.STRING, value)
-        elif type(value) == int :
-            return ATOM(T.INT, value)
-        elif type(value) == float :
+        t = type(value)
+        if t is int :
+            return _small_ints[value-SMALL_INT[0]] if SMALL_INT[0] <= value < SMALL_INT[1] else ATOM(T.INT, value)
+        elif t is bool :
+            return TRUE if value else FALSE
+        elif t is float :
             return ATOM(T.FLOAT, value)
-        elif type(value) == bool :
-            return ATOM(T.BOOL, value)
+        elif t is str :
+            return ATOM(T.STRING, value)
     
     def __init__(self, kind, value) :
         self.kind = kind
         self.value = value
+    def __reduce_ex__(self, protocol) :
+        if self.kind in (T.SYMBOL, T.KEYWORD, T.INT, T.BOOL) :
+            return (ATOM.make, (self.kind, self.value))
+        return object.__reduce_ex__(self, protocol)     # lambda可能经Cell引用自己，按槽保存才能处理环
+    def __deepcopy__(self, memo) :
+        """只有lambda要复制（连同它的Code、外层帧和缓存），其余原子不可修改，直接共享。"""
+        if self.kind is not T.LAMBDA :
+            return self
+        atom = memo[id(self)] = ATOM(self.kind, None)  # 先登记，经Cell回到自己时不再复制
+        atom.value = copy.deepcopy(self.value, memo)
+        return atom
     def __repr__(self) :
         return 'ATOM(%s:%s)' % (self.kind.name, str(self))
     def __str__(self) :
@@ -49,142 +174,754 @@ class ATOM :
         else :      # T.INT T.FLOAT T.KEYWORD T.SYMBOL
             return str(self.value)
     def isSYMBOL(self) :
-        return self.kind == T.SYMBOL
+        return self.kind is T.SYMBOL
+
+SMALL_INT = (-256, 1024)        # 这个范围内的整数原子是共享的
+_small_ints = [ ATOM(T.INT, i) for i in range(*SMALL_INT) ]
+_symbols = {}
+KEYWORDS = dict( (k, ATOM(T.KEYWORD, k)) for k in ('lambda', 'cond', 'define', 'define-memo', 'let', 'if', 'and', 'or') )
+TRUE, FALSE = ATOM(T.BOOL, True), ATOM(T.BOOL, False)
+ELSE = ATOM.make(T.SYMBOL, 'else')
+NIL = []                # 空表()，共享的，不可修改
 
 class RuntimeError(Exception) :
     pass
 
+# 虚拟机指令
+LOCAL0, LOCAL, GLOBAL, CONST, CALL, CALLK, JUMPF, JUMP, RETURN, LAMBDA, DEFINE, SETLOCAL, SHOWENV, MEMOSTORE = range(14)
+OPNAMES = 'LOCAL0 LOCAL GLOBAL CONST CALL CALLK JUMPF JUMP RETURN LAMBDA DEFINE SETLOCAL SHOWENV MEMOSTORE'.split()
+
+MAX_DEPTH = 200000      # 非尾递归的最大深度，每层约占几百字节堆内存
+class Unbound :
+    """UNBOUND的类型。pickle时按名字引用，载入后仍是同一个对象。"""
+    def __reduce__(self) :
+        return 'UNBOUND'
+    def __repr__(self) :
+        return 'UNBOUND'
+UNBOUND = Unbound()     # 未绑定的全局变量或尚未执行define的局部变量
+MEMO_SIZE = 4096        # define-memo函数缓存结果的默认个数上限
+
+class Cell :
+    """全局变量的存储单元，编译后的代码直接引用Cell，省去按名字查找。"""
+    __slots__ = ('name', 'value')
+    def __init__(self, name, value) :
+        self.name = name
+        self.value = value
+    def __repr__(self) :
+        return 'Cell(%s)' % self.name
+
+class Scope :
+    """编译期的作用域：names[i-1]是调用帧第i格的名字（第0格是外层帧），前nparams个是参数。"""
+    def __init__(self, parent, env, params=()) :
+        self.parent = parent
+        self.env = env
+        self.names = list(params)
+        self.nparams = len(params)
+    def declare(self, name) :
+        if name not in self.names :
+            self.names.append(name)
+    def resolve(self, name) :
+        """返回(depth, slot)，全局变量返回(None, None)。"""
+        depth, scope = 0, self
+        while scope.parent is not None :
+            if name in scope.names :
+                return depth, len(scope.names) - scope.names[::-1].index(name)
+            depth, scope = depth+1, scope.parent
+        return None, None
+
+class Code :
+    """编译后的指令序列，每条指令是(操作码, 参数)。lambda的Code还记录参数名、定义时的函数名，以及是否由define-memo定义。"""
+    __slots__ = ('ins', 'params', 'name', 'nlocals', 'memo')
+    def __init__(self, params=(), name=None) :
+        self.ins = []
+        self.params = params
+        self.name = name
+        self.nlocals = 0
+        self.memo = False
+    def __repr__(self) :
+        return '\n'.join( '%3d %-8s %s' % (i, OPNAMES[op], '' if arg is None else repr(arg)) for i,(op,arg) in enumerate(self.ins) )
+    def emit(self, op, arg=None) :
+        self.ins.append( (op, arg) )
+        return len(self.ins)-1
+    def patch(self, at) :
+        """把位置at的跳转指令的目标设为当前位置。"""
+        self.ins[at] = (self.ins[at][0], len(self.ins))
+    def finish(self) :
+        """结束编译：以RETURN收尾，跳到RETURN的JUMP直接改成RETURN。"""
+        self.emit(RETURN)
+        for i,(op,arg) in enumerate(self.ins) :
+            if op == JUMP and self.ins[arg][0] == RETURN :
+                self.ins[i] = (RETURN, None)
+        return self
+
+class Memo :
+    """define-memo函数的结果缓存，以参数值为键，超过maxsize时淘汰最久未用的。"""
+    __slots__ = ('name', 'maxsize', 'cache', 'hits', 'misses', '__weakref__')
+    def __init__(self, name, maxsize) :
+        self.name = name
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.hits = self.misses = 0
+    def get(self, key) :
+        val = self.cache.get(key, UNBOUND)
+        if val is UNBOUND :
+            self.misses += 1
+        else :
+            self.hits += 1
+            self.cache.move_to_end(key)
+        return val
+    def put(self, key, val) :
+        self.cache[key] = val
+        if len(self.cache) > self.maxsize :
+            self.cache.popitem(last=False)
+    def stats(self) :
+        calls = self.hits + self.misses
+        return { 'name' : self.name, 'size' : len(self.cache), 'maxsize' : self.maxsize,
+                 'hits' : self.hits, 'misses' : self.misses, 'hit_rate' : round(self.hits/calls, 2) if calls else 0.0 }
+
+def memo_key(x) :
+    """参数值 -> 可散列的键：原子取(kind, value)，表取各元素的键组成的元组，函数按对象本身。"""
+    if isinstance(x, (Pair, list)) :
+        return tuple( memo_key(e) for e in x )
+    elif x.kind is T.LAMBDA or x.kind is T.BUILTIN :
+        return x
+    return (x.kind, x.value)
+
+MEMO_INS = [ (MEMOSTORE, None) ]    # 缓存未命中时调用的返回点，把返回值存入缓存再回到调用者
+
+class Limit :
+    """单次求值的限制：lambda调用不超过steps次，运行不超过timeout秒。R0没有循环语句，限制调用次数就限制了执行的步数。
+       虚拟机每次调用lambda时tick一次，每1024次才看一次时钟。"""
+    def __init__(self, steps=None, timeout=None, clock=time.monotonic) :
+        self.steps = steps
+        self.timeout = timeout
+        self.clock = clock
+        self.deadline = None if timeout is None else clock() + timeout
+        self.count = 0
+    def tick(self) :
+        self.count += 1
+        if self.steps is not None and self.count > self.steps :
+            raise RuntimeError('step limit exceeded', self.steps)
+        if self.deadline is not None and self.count & 1023 == 0 and self.clock() > self.deadline :
+            raise RuntimeError('timeout', self.timeout)
+
+class Profile :
+    """性能统计。虚拟机在调用lambda、内置函数和RETURN处各检查一次intp.prof，不开启时几乎没有开销。
+       stack与虚拟机的调用链对应，第0层是顶层代码'<top>'；尾调用先退出调用者再进入被调用者。
+       累计时间只在函数最外层的一次调用返回时计入，递归不会重复计算；自身时间按调用链累加，供火焰图使用。"""
+    TOP = '<top>'
+    def __init__(self, clock=time.perf_counter) :
+        self.clock = clock
+        self.calls = {}
+        self.total = {}         # 名字 -> 累计时间
+        self.own = {}           # 名字 -> 自身时间
+        self.folded = {}        # 'a;b;c' -> 自身时间
+        self.stack = []         # [名字, 调用链, 进入时刻, 是否最外层]
+        self.active = {}        # 名字 -> 正在执行的层数
+        self.max_depth = 0
+        self.frames = 0
+        self.last = clock()
+    def _charge(self) :
+        now = self.clock()
+        if self.stack :
+            name, path = self.stack[-1][:2]
+            self.own[name] = self.own.get(name, 0.0) + now - self.last
+            self.folded[path] = self.folded.get(path, 0.0) + now - self.last
+        self.last = now
+        return now
+    def enter(self, name) :
+        now = self._charge()
+        path = self.stack[-1][1] + ';' + name if self.stack else name
+        n = self.active.get(name, 0)
+        self.active[name] = n+1
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.stack.append( [name, path, now, n == 0] )
+    def leave(self) :
+        now = self._charge()
+        name, path, t0, outer = self.stack.pop()
+        self.active[name] -= 1
+        if outer :
+            self.total[name] = self.total.get(name, 0.0) + now - t0
+    def call(self, name, tail) :
+        """调用lambda，分配了一个调用帧。"""
+        if tail and len(self.stack) > 1 :
+            self.leave()
+        self.frames += 1
+        self.enter(name)
+        if len(self.stack)-1 > self.max_depth :
+            self.max_depth = len(self.stack)-1
+    def builtin(self, fn, args) :
+        self.enter(NATIVE_NAMES.get(fn, fn.__name__))
+        try :
+            return fn(args)
+        finally :
+            self.leave()
+    def start(self) :
+        self.enter(Profile.TOP)
+    def stop(self) :
+        """一次eval结束（包括出错），退出所有未返回的调用。"""
+        while self.stack :
+            self.leave()
+
+    def stats(self) :
+        return { 'calls' : dict(self.calls), 'total' : dict(self.total), 'own' : dict(self.own),
+                 'max_depth' : self.max_depth, 'frames' : self.frames }
+    def report(self, limit=20) :
+        """按累计时间排序的报告。"""
+        lines = [ '%10s %10s %10s %10s  %s' % ('calls', 'total(s)', 'own(s)', 'per call', 'name') ]
+        for name in sorted(self.calls, key=lambda k:-self.total.get(k, 0.0))[:limit] :
+            t, n = self.total.get(name, 0.0), self.calls[name]
+            lines.append( '%10d %10.4f %10.4f %10.2e  %s' % (n, t, self.own.get(name, 0.0), t/n, name) )
+        lines.append( 'max recursion depth %d, %d frames allocated' % (self.max_depth, self.frames) )
+        return '\n'.join(lines)
+    def write_folded(self, f) :
+        """写出火焰图工具(flamegraph.pl等)使用的折叠调用栈，每行'a;b;c 微秒数'。"""
+        for path, t in sorted(self.folded.items()) :
+            us = round(t*1e6)
+            if us > 0 :
+                print(path, us, file=f)
+
+# --- Builtins ----------------------------------------------------------
+# 原生实现的内置函数，参数是ATOM（或表）的列表，返回ATOM。两个参数是最常见的情形，单独走一条快速路径。
+# 表是Pair串成的链，以NIL结尾。cons、cdr都是O(1)的，新表与原来的表共享尾部；解析器产出的程序仍是Python的列表。
+
+class Pair :
+    """非空表的一个结点(cons单元)：car是第一个元素，cdr是其余部分（Pair或NIL），n是表长，所以length也是O(1)的。
+       可以像列表一样迭代。pickle、deepcopy时按元素的列表保存，长表不会递归过深，但共享的尾部不再共享。"""
+    __slots__ = ('car', 'cdr', 'n')
+    def __init__(self, car, cdr) :
+        self.car = car
+        self.cdr = cdr
+        self.n = 1 if cdr is NIL else cdr.n + 1
+    def __len__(self) :
+        return self.n
+    def __iter__(self) :
+        p = self
+        while p is not NIL :
+            yield p.car
+            p = p.cdr
+    def __getstate__(self) :
+        return list(self)
+    def __setstate__(self, items) :
+        self.car, self.cdr, self.n = items[0], _pairs(items[1:]), len(items)
+    def __repr__(self) :
+        return 'Pair%s' % SxParser.toString(self)
+
+def _pairs(items, tail=NIL) :
+    """Python的序列 -> 表，接在tail前面。"""
+    for x in reversed(items) :
+        tail = Pair(x, tail)
+    return tail
+
+def truth(x) :
+    """条件判断的真假：原子看它的值，表总是真。"""
+    return x.value if isinstance(x, ATOM) else x is not None
+
+def _fold(op, args) :
+    v = args[0].value
+    for a in args[1:] :
+        v = op(v, a.value)
+    return ATOM.pack(v)
+
+def _chain(op, args) :
+    return TRUE if all( op(a.value, b.value) for a,b in zip(args, args[1:]) ) else FALSE
+
+def _add(args) :
+    if len(args) == 2 :
+        return ATOM.pack(args[0].value + args[1].value)
+    return _fold(operator.add, args) if args else ATOM.pack(0)
+def _sub(args) :
+    if len(args) == 2 :
+        return ATOM.pack(args[0].value - args[1].value)
+    return ATOM.pack(-args[0].value) if len(args) == 1 else _fold(operator.sub, args)
+def _mul(args) :
+    if len(args) == 2 :
+        return ATOM.pack(args[0].value * args[1].value)
+    return _fold(operator.mul, args) if args else ATOM.pack(1)
+def _div(args) :
+    """全是整数时整除，否则是浮点除法。"""
+    if all( a.kind is T.INT for a in args ) :
+        return _fold(operator.floordiv, args)
+    return _fold(operator.truediv, args)
+def _quotient(args) :
+    a, b = args[0].value, args[1].value
+    q = abs(a)//abs(b)
+    return ATOM.pack(q if (a<0) == (b<0) else -q)
+def _remainder(args) :
+    """余数与被除数同号。"""
+    a, b = args[0].value, args[1].value
+    r = abs(a)%abs(b)
+    return ATOM.pack(r if a>=0 else -r)
+def _modulo(args) :
+    """余数与除数同号。"""
+    return ATOM.pack(args[0].value % args[1].value)
+
+def _abs(args) :
+    return ATOM.pack(abs(args[0].value))
+def _min(args) :
+    return ATOM.pack(min( a.value for a in args ))
+def _max(args) :
+    return ATOM.pack(max( a.value for a in args ))
+
+def _lt(args) :
+    if len(args) == 2 :
+        return TRUE if args[0].value < args[1].value else FALSE
+    return _chain(operator.lt, args)
+def _gt(args) :
+    if len(args) == 2 :
+        return TRUE if args[0].value > args[1].value else FALSE
+    return _chain(operator.gt, args)
+def _eq(args) :
+    if len(args) == 2 :
+        return TRUE if args[0].value == args[1].value else FALSE
+    return _chain(operator.eq, args)
+def _le(args) :
+    if len(args) == 2 :
+        return TRUE if args[0].value <= args[1].value else FALSE
+    return _chain(operator.le, args)
+def _ge(args) :
+    if len(args) == 2 :
+        return TRUE if args[0].value >= args[1].value else FALSE
+    return _chain(operator.ge, args)
+def _ne(args) :
+    return TRUE if args[0].value != args[1].value else FALSE
+def _not(args) :
+    return FALSE if truth(args[0]) else TRUE
+
+def _islist(x) :
+    if x is not NIL and type(x) is not Pair :
+        raise RuntimeError('not a list', x)
+    return x
+def _cons(args) :
+    return Pair(args[0], _islist(args[1]))
+def _car(args) :
+    if not _islist(args[0]) :
+        raise RuntimeError('car of empty list')
+    return args[0].car
+def _cdr(args) :
+    if not _islist(args[0]) :
+        raise RuntimeError('cdr of empty list')
+    return args[0].cdr
+def _list(args) :
+    return _pairs(args)
+def _append(args) :
+    """复制除最后一个以外的表，新表共享最后一个表。"""
+    tail = _islist(args[-1]) if args else NIL
+    for a in reversed(args[:-1]) :
+        tail = _pairs(list(_islist(a)), tail)
+    return tail
+def _length(args) :
+    return ATOM.pack(len(_islist(args[0])))
+def _null(args) :
+    return TRUE if args[0] is NIL else FALSE
+def _pair(args) :
+    return TRUE if type(args[0]) is Pair else FALSE
+
+def _equal(a, b) :
+    if isinstance(a, (Pair, list)) or isinstance(b, (Pair, list)) :
+        return isinstance(a, (Pair, list)) and isinstance(b, (Pair, list)) and len(a) == len(b) and all( _equal(x, y) for x,y in zip(a, b) )
+    return a is b or (a.kind is b.kind and a.value == b.value)
+def _is_eq(args) :
+    a, b = args
+    return TRUE if a is b or (isinstance(a, ATOM) and isinstance(b, ATOM) and a.kind is b.kind and a.kind in (T.INT, T.FLOAT) and a.value == b.value) else FALSE
+def _is_equal(args) :
+    return TRUE if _equal(args[0], args[1]) else FALSE
+
+def _display(args) :
+    x = args[0]
+    print(x.value if isinstance(x, ATOM) and x.kind is T.STRING else SxParser.toString(x), end='')
+def _newline(args) :
+    print()
+
+NATIVES = {
+    '+'         : _add,
+    '-'         : _sub,
+    '*'         : _mul,
+    '/'         : _div,
+    'quotient'  : _quotient,
+    'remainder' : _remainder,
+    'modulo'    : _modulo,
+    'abs'       : _abs,
+    'min'       : _min,
+    'max'       : _max,
+    '<'         : _lt,
+    '>'         : _gt,
+    '='         : _eq,
+    '<='        : _le,
+    '>='        : _ge,
+    '!='        : _ne,
+    'not'       : _not,
+    'cons'      : _cons,
+    'car'       : _car,
+    'cdr'       : _cdr,
+    'list'      : _list,
+    'append'    : _append,
+    'length'    : _length,
+    'null?'     : _null,
+    'pair?'     : _pair,
+    'eq?'       : _is_eq,
+    'equal?'    : _is_equal,
+    'display'   : _display,
+    'newline'   : _newline,
+}
+NATIVE_NAMES = dict( (fn, name) for name,fn in NATIVES.items() )
+
 class Interp0 :
     """每个解释器对象拥有独立的执行环境。"""
     class Env :
-        """符号表环境，简单以字典列表实现。"""
-        def __init__(self, symtable) :
-            self._symtable = symtable
+        """全局符号表，符号名到Cell的字典。编译时符号即绑定到Cell，执行时不再按名字查找。
+           lambda的参数和局部定义不在这里，而在调用帧里按(depth, slot)寻址。"""
+        def __init__(self, syms) :
+            self.cells = dict( (k, Cell(k, v)) for k,v in syms.items() )
+        def copy(self) :
+            """复制出独立的符号表：Cell是新的，lambda值连同它们的Code一起复制，Code里的GLOBAL、DEFINE等指令改指新的Cell，
+               此后两边的define互不影响。原子和表不会被修改，仍是共享的。"""
+            env = Interp0.Env({})
+            env.cells = dict( (k, Cell(k, c.value)) for k,c in self.cells.items() )
+            memo = dict( (id(c), env.cells[k]) for k,c in self.cells.items() )     # deepcopy遇到旧Cell时换成新的
+            memo[id(self)] = env
+            for c in env.cells.values() :
+                v = c.value
+                if v is not UNBOUND and (not isinstance(v, ATOM) or v.kind is T.LAMBDA) :
+                    c.value = copy.deepcopy(v, memo)    # lambda，或者可能含有lambda的表
+            return env
         def __str__(self) :
-            str_syms = [ '{ ' + ' | '.join( '%s : %s'%(k,v) for k,v in syms.items() ) + ' }' for syms in self._symtable ]
-            return '\n'.join(str_syms)
+            return '{ ' + ' | '.join( '%s : %s'%(k,c.value) for k,c in self.cells.items() if c.value is not UNBOUND ) + ' }'
+        def cell(self, name) :
+            """取名字对应的Cell，尚未定义时先建一个未绑定的，之后的define会填上它。"""
+            c = self.cells.get(name)
+            if c is None :
+                c = self.cells[name] = Cell(name, UNBOUND)
+            return c
         def add(self, sym, val) :
             if isinstance(sym, ATOM) and sym.isSYMBOL() :
-                self._symtable[-1][sym.value] = val
+                self.cell(sym.value).value = val
             else : raise RuntimeError('add no symbol reference', sym, val)
         def dele(self, sym) :
-            if isinstance(sym, ATOM) and sym.isSYMBOL() and sym.value in self._symtable[-1] :
-                del self._symtable[-1][sym.value]
+            if isinstance(sym, ATOM) and sym.isSYMBOL() and self.cell(sym.value).value is not UNBOUND :
+                self.cells[sym.value].value = UNBOUND
             else : raise RuntimeError('unknown symbol', sym)
         def lookup(self, sym) :
             if isinstance(sym, ATOM) and sym.isSYMBOL() :
-                for syms in reversed(self._symtable) :
-                    if sym.value in syms : return syms[sym.value]
+                val = self.cell(sym.value).value
+                if val is not UNBOUND : return val
             raise RuntimeError('unknown symbol', sym)
-        def extend(self, syms) :
-            symtable = self._symtable[:]
-            symtable.append(syms)
-            return Interp0.Env(symtable)
-    
-    def _call_lambda(atom, expr, env) :
-        args = [ Interp0._ev(e, env) for e in expr[1:] ]
-        params = atom.value[0]
-        lambdy = atom.value[1]
-        env0 = atom.value[2]
-        env1 = env0.extend(dict(zip(params, args)))
-        return Interp0._ev(lambdy, env1)
-    def _call_builtin(atom, expr, env) :
-        args = [ Interp0._ev(e, env) for e in expr[1:] ]
-        return atom.value(args)
-    def _call_keyword(atom, expr, env) :
-        if atom.value == 'lambda' :     # (lambda (x y ...) (+ x y ...))
-            params = [ a.value for a in expr[1] ]
-            lambdy = expr[2]
-            val = (params, lambdy, env)
-            return ATOM(T.LAMBDA, val)
-        elif atom.value == 'cond' :     # (cond ((> x y) a) ((< x y) b) ... (#t c))
-            for choose in expr[1:] :
-                p = Interp0._ev(choose[0], env)
-                if p.value :
-                    return Interp0._ev(choose[1], env)
-            else : return []            # cond all false, return undetermind
-        elif atom.value == 'define' :   # (define x a) || (define (f x y ...) (+ x y ...)) | (define) // return nothing?
-            if len(expr) == 1 :
-                print(env)
-            elif len(expr) == 3 :
-                if isinstance(expr[1], ATOM) :
-                    env.add(expr[1], Interp0._ev(expr[2], env))
-                elif isinstance(expr[1], list) :
-                    expr_lambda = [ ATOM(T.KEYWORD, 'lambda'), expr[1][1:], expr[2] ]
-                    Interp0._ev( [ ATOM(T.KEYWORD, 'define'), expr[1][0], expr_lambda ] , env)
-        elif atom.value == 'let' :      # (let ((x a) (y b) ...) (+ x y ...)) // just call an unamed lambda expr
-            params,args = zip(expr[1])
-            expr_lambda = [ ATOM(T.KEYWORD, 'lambda'), list(params), expr[2] ]
-            return Interp0._ev( [expr_lambda] + list(args) , env)
-    def _ev(expr, env) :
-        """解释器核心代码"""
-        #print(repr(expr), env)
+
+    # --- 编译：把解析器输出的列表一次性翻译成指令序列，特殊形式在编译期展开 ---
+    # 符号在编译时解析：lambda参数和局部定义解析成调用帧里的(depth, slot)，其余解析成全局Cell。
+    # 调用帧是一个列表[外层帧, 参数..., 局部定义...]，每次调用只分配这一个对象。
+    def compile(expr, env) :
+        """把一个S表达式编译成顶层Code，env为全局符号表，执行结果留在栈顶后RETURN。"""
+        code = Code()
+        Interp0._compile(expr, code, Scope(None, env))
+        return code.finish()
+    def _compile(expr, code, scope) :
         if isinstance(expr, list) :
-            if len(expr) > 0 :
-                atom = Interp0._ev(expr[0], env)
-                if isinstance(atom, ATOM) :
-                    if atom.kind == T.LAMBDA :
-                        return Interp0._call_lambda(atom, expr, env)
-                    elif atom.kind == T.BUILTIN :
-                        return Interp0._call_builtin(atom, expr, env)
-                    elif atom.kind == T.KEYWORD :
-                        return Interp0._call_keyword(atom, expr, env)
-                raise RuntimeError('not callable', atom)
-            else : return expr  # ()
+            if len(expr) == 0 :
+                code.emit(CONST, NIL)               # ()
+            elif isinstance(expr[0], ATOM) and expr[0].kind == T.KEYWORD :
+                Interp0._compile_keyword(expr[0].value, expr, code, scope)
+            elif all( isinstance(e, ATOM) or e == [] for e in expr ) :
+                code.emit(CALLK, tuple( Interp0._operand(e, scope) for e in expr ))
+            else :
+                for e in expr :
+                    Interp0._compile(e, code, scope)
+                code.emit(CALL, len(expr)-1)
         elif isinstance(expr, ATOM) :
-            if expr.isSYMBOL() :
-                return env.lookup(expr)
-            else : return expr  # atom
+            code.emit(*Interp0._operand(expr, scope))
+        else :
+            raise RuntimeError('bad expression', expr)
+    def _operand(expr, scope) :
+        """符号和常量的取值指令：(LOCAL0, slot)、(LOCAL, (depth, slot))、(GLOBAL, cell)或(CONST, 值)。
+           CALLK直接用这些指令取操作数，不必各占一条指令。"""
+        if isinstance(expr, ATOM) and expr.isSYMBOL() :
+            depth, slot = scope.resolve(expr.value)
+            if slot is None :
+                return (GLOBAL, scope.env.cell(expr.value))
+            elif depth == 0 and slot <= scope.nparams :
+                return (LOCAL0, slot)               # 本帧的参数，一定已绑定
+            return (LOCAL, (depth, slot))
+        return (CONST, expr if expr != [] else NIL) # 字面量常量
+    def _always(test) :
+        return test is ELSE or test is TRUE
+    def _defines(expr) :
+        """找出lambda体内（不进入内层lambda、let）define的名字，预先在帧里为它们留出位置。"""
+        if isinstance(expr, list) and len(expr) > 0 and isinstance(expr[0], ATOM) and expr[0].kind == T.KEYWORD :
+            if expr[0].value in ('define', 'define-memo') and len(expr) == 3 :
+                return [ expr[1].value if isinstance(expr[1], ATOM) else expr[1][0].value ]
+            elif expr[0].value == 'cond' :
+                return [ name for choose in expr[1:] for e in choose for name in Interp0._defines(e) ]
+            elif expr[0].value in ('if', 'and', 'or') :
+                return [ name for e in expr[1:] for name in Interp0._defines(e) ]
+        return []
+    def _compile_lambda(params, body, scope, name=None, memo=False) :
+        params = [ a.value for a in params ]
+        lscope = Scope(scope, scope.env, params)
+        for d in Interp0._defines(body) :
+            lscope.declare(d)
+        lcode = Code(params, name)
+        lcode.memo = memo
+        Interp0._compile(body, lcode, lscope)
+        lcode.nlocals = len(lscope.names) - len(params)
+        return lcode.finish()
+    def _compile_keyword(kw, expr, code, scope) :
+        if kw == 'lambda' :             # (lambda (x y ...) (+ x y ...))
+            code.emit(LAMBDA, Interp0._compile_lambda(expr[1], expr[2], scope))
+        elif kw == 'cond' :             # (cond ((> x y) a) ((< x y) b) ... (#t c))
+            jumps = []
+            for choose in expr[1:] :
+                if Interp0._always(choose[0]) :     # else或#t分支之后的分支不会执行
+                    Interp0._compile(choose[1], code, scope)
+                    break
+                Interp0._compile(choose[0], code, scope)
+                jf = code.emit(JUMPF)
+                Interp0._compile(choose[1], code, scope)
+                jumps.append( code.emit(JUMP) )
+                code.patch(jf)
+            else :
+                code.emit(CONST, NIL)   # cond all false, return undetermind
+            for j in jumps :
+                code.patch(j)
+        elif kw == 'define' or kw == 'define-memo' :    # (define x a) || (define (f x y ...) (+ x y ...)) | (define) // return nothing
+            if kw == 'define-memo' and not (len(expr) == 3 and isinstance(expr[1], list)) :
+                raise RuntimeError('bad define-memo', SxParser.toString(expr))
+            if len(expr) == 1 :
+                code.emit(SHOWENV, scope.env)
+                return
+            elif len(expr) == 3 and isinstance(expr[1], ATOM) :
+                sym = expr[1]
+                Interp0._compile(expr[2], code, scope)
+            elif len(expr) == 3 and isinstance(expr[1], list) :
+                sym = expr[1][0]
+                code.emit(LAMBDA, Interp0._compile_lambda(expr[1][1:], expr[2], scope, sym.value, kw == 'define-memo'))
+            else :
+                raise RuntimeError('bad define', SxParser.toString(expr))
+            if scope.parent is None :
+                code.emit(DEFINE, scope.env.cell(sym.value))
+            else :
+                code.emit(SETLOCAL, scope.resolve(sym.value)[1])
+        elif kw == 'if' :               # (if p x y) | (if p x) // 只求值一个分支
+            Interp0._compile(expr[1], code, scope)
+            jf = code.emit(JUMPF)
+            Interp0._compile(expr[2], code, scope)
+            j = code.emit(JUMP)
+            code.patch(jf)
+            Interp0._compile(expr[3] if len(expr) > 3 else NIL, code, scope)
+            code.patch(j)
+        elif kw == 'and' or kw == 'or' :    # (and x y ...) (or x y ...) // 短路求值，结果为#t或#f
+            jumps = []
+            for e in expr[1:] :
+                Interp0._compile(e, code, scope)
+                if kw == 'and' :
+                    jumps.append( code.emit(JUMPF) )
+                else :
+                    jf = code.emit(JUMPF)
+                    code.emit(CONST, TRUE)
+                    jumps.append( code.emit(JUMP) )
+                    code.patch(jf)
+            if kw == 'and' :
+                code.emit(CONST, TRUE)
+                j = code.emit(JUMP)
+                for jf in jumps :
+                    code.patch(jf)
+                code.emit(CONST, FALSE)
+                code.patch(j)
+            else :
+                code.emit(CONST, FALSE)
+                for j in jumps :
+                    code.patch(j)
+        elif kw == 'let' :              # (let ((x a) (y b) ...) (+ x y ...)) // just call an unamed lambda expr
+            params = [ b[0] for b in expr[1] ]
+            code.emit(LAMBDA, Interp0._compile_lambda(params, expr[2], scope))
+            for b in expr[1] :
+                Interp0._compile(b[1], code, scope)
+            code.emit(CALL, len(params))
+        else :
+            raise RuntimeError('unknown keyword', kw)
 
+    # --- 执行：栈式虚拟机 ---
+    def _local(env, depth, slot) :
+        for i in range(depth) :
+            env = env[0]
+        return env[slot]
+    def _run(code, env, intp) :
+        """虚拟机核心代码，逐条执行指令。操作数放在值栈上，调用lambda时把返回点压入帧栈而不递归调用_run，
+           RETURN弹出帧栈，返回值恰好留在调用者的栈顶。env是当前调用帧，顶层代码为None。
+           紧跟RETURN的调用是尾调用，不压入返回点，尾递归的循环只占常数内存；
+           非尾递归的深度受intp.max_depth限制（帧栈在堆上，与Python的递归深度无关）。
+           define-memo的函数先查缓存，未命中时压入的返回点是MEMO_INS，帧里带着缓存、键和调用者的返回点，返回值经它存入缓存。
+           这个返回点即使是尾调用也要压入，所以对define-memo函数的调用总占一层深度，尾递归也不是常数空间。
+           intp.prof不是None时在调用和返回处记录性能统计，intp.limit不是None时每次调用lambda检查限制。"""
+        max_depth = intp.max_depth
+        prof = intp.prof
+        limit = intp.limit
+        stack = []
+        push = stack.append
+        frames = []
+        ins = code.ins
+        pc = 0
+        while True :
+            op, arg = ins[pc]
+            pc += 1
+            if op == CALLK :
+                args = []
+                for k,v in arg :
+                    if k == LOCAL0 :
+                        args.append(env[v])
+                    elif k == CONST :
+                        args.append(v)
+                    else :
+                        a = v.value if k == GLOBAL else Interp0._local(env, *v)
+                        if a is UNBOUND :
+                            raise RuntimeError('unknown symbol', v.name if k == GLOBAL else v)
+                        args.append(a)
+                atom = args[0]
+            elif op == LOCAL0 :
+                push(env[arg])
+                continue
+            elif op == GLOBAL :
+                a = arg.value
+                if a is UNBOUND :
+                    raise RuntimeError('unknown symbol', arg.name)
+                push(a)
+                continue
+            elif op == JUMPF :
+                a = stack.pop()
+                if a is FALSE or (a is not TRUE and not truth(a)) :
+                    pc = arg
+                continue
+            elif op == CALL :
+                at = len(stack)-arg-1
+                args = stack[at:]
+                del stack[at:]
+                atom = args[0]
+            elif op == RETURN :
+                if not frames :
+                    return stack.pop()
+                if prof is not None :
+                    prof.leave()
+                ins, pc, env = frames.pop()
+                continue
+            elif op == CONST :
+                push(arg)
+                continue
+            elif op == LOCAL :
+                a = Interp0._local(env, *arg)
+                if a is UNBOUND :
+                    raise RuntimeError('unknown symbol', arg)
+                push(a)
+                continue
+            elif op == JUMP :
+                pc = arg
+                continue
+            elif op == LAMBDA :
+                memo = None
+                if arg.memo :
+                    memo = Memo(arg.name, intp.memo_size)
+                    intp.memos.add(memo)
+                push(ATOM(T.LAMBDA, (arg.params, arg, env, memo)))
+                continue
+            elif op == DEFINE :
+                arg.value = stack.pop()
+                push(None)
+                continue
+            elif op == SETLOCAL :
+                env[arg] = stack.pop()
+                push(None)
+                continue
+            elif op == SHOWENV :
+                print(arg)
+                push(None)
+                continue
+            elif op == MEMOSTORE :      # env是MEMO_INS帧里的(缓存, 键, 调用者的ins, pc, env)
+                memo, key, ins, pc, env = env
+                memo.put(key, stack[-1])
+                continue
+            # CALL, CALLK：args[0]是被调用者，把它换成外层帧就成了lambda的调用帧
+            if isinstance(atom, ATOM) :
+                if atom.kind == T.LAMBDA :
+                    params, lcode, env0, memo = atom.value
+                    if len(params) != len(args)-1 :
+                        raise RuntimeError('wrong number of args', atom, len(args)-1)
+                    if limit is not None :
+                        limit.tick()
+                    if memo is not None :
+                        key = tuple( memo_key(a) for a in args[1:] )
+                        val = memo.get(key)
+                        if val is not UNBOUND :
+                            push(val)
+                            continue
+                    args[0] = env0
+                    if lcode.nlocals :
+                        args += [UNBOUND]*lcode.nlocals
+                    tail = memo is None and ins[pc][0] == RETURN
+                    if not tail :               # 尾调用直接沿用调用者的返回点，define-memo的函数要经MEMO_INS存缓存，不算尾调用
+                        if len(frames) >= max_depth :
+                            raise RuntimeError('recursion too deep', len(frames))
+                        frames.append( (ins, pc, env) if memo is None else (MEMO_INS, 0, (memo, key, ins, pc, env)) )
+                    if prof is not None :
+                        prof.call(lcode.name or '<lambda>', tail)
+                    ins, pc, env = lcode.ins, 0, args
+                    continue
+                elif atom.kind == T.BUILTIN :
+                    del args[0]
+                    push(atom.value(args) if prof is None else prof.builtin(atom.value, args))
+                    continue
+            raise RuntimeError('not callable', atom)
     def builtins(name) :
-        """builtin functions"""
-        if name == 'add' :
-            f = lambda args:ATOM.pack( reduce(lambda x,y:(x+y) , [a.value for a in args[1:]], args[0].value) )
-        elif name == 'sub' :
-            f = lambda args:ATOM.pack( -args[0].value if len(args)==1 \
-                    else reduce(lambda x,y:(x-y) , [a.value for a in args[1:]], args[0].value) )
-        elif name == 'mul' :
-            f = lambda args:ATOM.pack( reduce(lambda x,y:(x*y) , [a.value for a in args[1:]], args[0].value) )
-        elif name == 'div' :
-            f = lambda args:ATOM.pack( reduce(lambda x,y:(x//y) , [a.value for a in args[1:]], args[0].value) \
-                    if reduce(lambda x,y:(x and y.kind==T.INT), args, True) \
-                    else reduce(lambda x,y:(x/y) , [a.value for a in args[1:]], args[0].value) )
-        elif name == 'lt' :
-            f = lambda args:ATOM.pack( args[0].value < args[1].value )
-        elif name == 'gt' :
-            f = lambda args:ATOM.pack( args[0].value > args[1].value )
-        elif name == 'eq' :
-            f = lambda args:ATOM.pack( args[0].value == args[1].value )
-        return ATOM(T.BUILTIN, f)
-
-    def __init__(self, syms={}, load='') :
-        builtin = {
-            '+'     : 'add',
-            '-'     : 'sub',
-            '*'     : 'mul',
-            '/'     : 'div',
-            '<'     : 'lt',
-            '>'     : 'gt',
-            '='     : 'eq',
-        }
-        symtable = [ syms if syms else dict( (k, Interp0.builtins(v)) for k,v in builtin.items() ) , {} ]
-        self.env = Interp0.Env(symtable)
-        code = ''' ; preload code
-        (define else #t)
-        (define (not x) (cond (x #f) (else #t)) )
-        (define (and x y) (cond ((not x) #f) ((not y) #f) (else #t)) )
-        (define (or  x y) (cond (x #t) (y #t) (else #f)) )
-        (define (if p x y) (cond (p x) (else y)) )
-        (define (!= x y) (not (= x y)) )
-        (define (>= x y) (or (> a b) (= a b)) )
-        (define (<= x y) (or (< x y) (= x y)) )
-        '''
-        self.evals( SxParser.fromString(load if load else code) )
+        """builtin functions，原生实现见NATIVES"""
+        return ATOM(T.BUILTIN, NATIVES[name])
+
+    PRELUDE = ''' ; preload code
+    (define else #t)
+    '''
+    _base = None
+    def base() :
+        """执行过预载代码的冻结环境，不带参数构造的解释器都从它复制，不再重复执行预载代码。"""
+        if Interp0._base is None :
+            Interp0._base = Interp0(load=Interp0.PRELUDE).env
+        return Interp0._base
+
+    def __init__(self, syms={}, load='', max_depth=MAX_DEPTH, memo_size=MEMO_SIZE, profile=False, env=None) :
+        """env给出时直接使用这个全局环境，不执行预载代码。"""
+        self.max_depth = max_depth
+        self.memo_size = memo_size
+        self.memos = weakref.WeakSet()
+        self.prof = None
+        self.limit = None
+        if env is None and not syms and not load :
+            env = Interp0.base().copy()
+        if env is not None :
+            self.env = env
+            for c in env.cells.values() :
+                if isinstance(c.value, ATOM) and c.value.kind is T.LAMBDA and c.value.value[3] is not None :
+                    self.memos.add(c.value.value[3])
+        else :
+            self.env = Interp0.Env(syms if syms else dict( (k, Interp0.builtins(k)) for k in NATIVES ))
+            self.evals( SxParser.fromString(load if load else Interp0.PRELUDE) )
+        if profile :
+            self.prof = Profile()
+    def fork(self) :
+        """复制当前环境（见Env.copy）得到新的解释器，之后两边的define互不影响，已定义的函数也各自引用自己一边的定义。"""
+        return Interp0(max_depth=self.max_depth, memo_size=self.memo_size, profile=self.prof is not None, env=self.env.copy())
     def eval(self, expr) :
-        return Interp0._ev(expr, self.env)
+        """解释器核心代码：以self.env为全局符号表编译，交给虚拟机执行"""
+        return self.execute(Interp0.compile(expr, self.env))
+    def execute(self, code) :
+        """执行以self.env编译好的顶层Code。"""
+        if self.prof is None :
+            return Interp0._run(code, None, self)
+        self.prof.start()
+        try :
+            return Interp0._run(code, None, self)
+        finally :
+            self.prof.stop()
     def evals(self, exprs) :
         for e in exprs : v = self.eval(e)
         return v
+    def memo_stats(self) :
+        """各个define-memo函数的缓存统计：当前大小、容量、命中与未命中次数、命中率。"""
+        return sorted( (m.stats() for m in self.memos), key=lambda st:st['name'] or '' )
 
 # --- Parser ----------------------------------------------------------
 import re
@@ -192,6 +929,62 @@ import re
 class SyntaxError(Exception) :
     pass
 
+# 词法规则合成一个正则表达式，模块载入时编译一次，每次匹配连同前导空白取出一个单词（注释不产生分组）。
+# 原子(ATOM)的分类用ATOM_PATTN完整匹配，结果按原子文本缓存，同一个符号或数字只分类一次。
+TOKEN_PATTN = re.compile(r"""[ \t\f\v\r\n]*(?:;[^\r\n]*|(\()|(\))|("[^\r\n]*?")|('\()|([^ \t\f\v\r\n()]+))""")
+ATOM_SPEC = [
+    ('FLOAT',       r'[+-]?\d+\.\d*'),
+    ('INT',         r'[+-]?\d+'),
+    ('BOOL',        r'#[tf]'),
+    ('KEYWORD',     r'lambda|cond|define-memo|define|let|if|and|or'),
+]
+ATOM_PATTN = re.compile( '|'.join( '(?P<%s>%s)' % pair for pair in ATOM_SPEC ) )
+
+_atoms = {}
+ATOM_CACHE = 1<<16      # 缓存的原子文本个数上限，数据文件里大量不同的数不会撑大缓存
+def _atom(text) :
+    """原子文本 -> ATOM"""
+    atom = _atoms.get(text)
+    if atom is None :
+        am = ATOM_PATTN.fullmatch(text)
+        kind = am.lastgroup if am else 'SYMBOL'
+        if kind == 'INT' :
+            atom = ATOM.pack(int(text))
+        elif kind == 'FLOAT' :
+            atom = ATOM.pack(float(text))
+        elif kind == 'BOOL' :
+            atom = ATOM.pack(text == '#t')
+        elif kind == 'KEYWORD' :
+            atom = KEYWORDS[text]
+        else :
+            atom = ATOM.make(T.SYMBOL, text)
+        if len(_atoms) < ATOM_CACHE :
+            _atoms[text] = atom
+    return atom
+
+def _tokens(line) :
+    """词法分析，产出括号字符串'(' ')' "'("或ATOM。"""
+    for lp, rp, string, qlp, atom in TOKEN_PATTN.findall(line) :
+        if atom :
+            yield _atom(atom)
+        elif lp or rp or qlp :
+            yield lp or rp or qlp
+        elif string :
+            yield ATOM(T.STRING, string[1:-1])
+
+def tokenize(line) :
+    """词法分析，产出(kind, value)：原子的kind是T.INT等，括号的kind是'LP' 'RP' 'QLP'。
+
+    >>> list(tokenize('(+ 1 2.5 x12 12x "s" #t) ; comment'))
+    [('LP', '('), (<T.SYMBOL: 8>, '+'), (<T.INT: 2>, 1), (<T.FLOAT: 3>, 2.5), (<T.SYMBOL: 8>, 'x12'), (<T.SYMBOL: 8>, '12x'), (<T.STRING: 1>, 's'), (<T.BOOL: 4>, True), ('RP', ')')]
+    """
+    brackets = { '(' : 'LP', ')' : 'RP', "'(" : 'QLP' }
+    for tok in _tokens(line) :
+        if isinstance(tok, ATOM) :
+            yield tok.kind, tok.value
+        else :
+            yield brackets[tok], tok
+
 class SxParser :
     """S表达式解析器，支持增量式解析。"""
     def fromString(lines) :
@@ -201,8 +994,25 @@ class SxParser :
             return parser.exprs
         else :
             raise SyntaxError('unexpect end')
+    def fromStream(source) :
+        """从文件对象或字符串块的迭代器流式解析，每当一个顶层表达式闭合就产出它，内存只与单个表达式的大小有关。
+
+        >>> list(SxParser.fromStream(['(define (f x) ', '(* x 2)) (f', ' 21)\\n', '"end"']))
+        [[ATOM(KEYWORD:define), [ATOM(SYMBOL:f), ATOM(SYMBOL:x)], [ATOM(SYMBOL:*), ATOM(SYMBOL:x), ATOM(INT:2)]], [ATOM(SYMBOL:f), ATOM(INT:21)], ATOM(STRING:"end")]
+        """
+        parser = SxParser()
+        rest = ''
+        for chunk in source :
+            lines, nl, rest = (rest + chunk).rpartition('\n')   # 单词不跨行，只把完整的行交给feed
+            if nl :
+                parser.feed(lines + nl)
+                yield from parser.done()
+        parser.feed(rest)
+        yield from parser.done()
+        if not parser.complete() :
+            raise SyntaxError('unexpect end')
     def toString(expr) :
-        if isinstance(expr, list) :
+        if isinstance(expr, (Pair, list)) :
             return '(' + ' '.join( SxParser.toString(e) for e in expr ) + ')'
         elif isinstance(expr, ATOM) :
             return str(expr)
@@ -214,79 +1024,239 @@ class SxParser :
         self.where = [self.exprs]       # stack
     def complete(self) :
         return len(self.where) == 1
+    def done(self) :
+        """取走已经闭合的顶层表达式，正在解析的最后一个留在exprs里。"""
+        n = len(self.exprs) if self.complete() else len(self.exprs)-1
+        exprs = self.exprs[:n]
+        del self.exprs[:n]
+        return exprs
     def feed(self, line) :
-        def tokenize(line) :
-            token_spec = [
-                ('WHITE',       r'[ \t\f\v]+'),
-                ('NEWLINE',     r'[\r\n]'),
-                ('COMMENT',     r';.*[\r\n]'),
-                ('QLP',         '\'\('),
-                ('LP',          r'\('),
-                ('RP',          r'\)'),
-                ('STRING',      r'"([^\r\n]*?)"'),
-                ('ATOM',        r'[^ \t\f\v\r\n\(\)]+'),
-            ]
-            atom_spec = [
-                ('INT',         r'[+-]?\d+'),
-                ('FLOAT',       r'[+-]?\d+\.\d*'),
-                ('BOOL',        r'#[tf]'),
-                ('KEYWORD',     r'lambda|cond|define|let'),
-            ]
-            token_regex = '|'.join( '(?P<%s>%s)' % pair for pair in token_spec )
-            token_pattn = re.compile(token_regex)
-            atom_regex = '|'.join( '(?P<%s>%s)' % pair for pair in atom_spec )
-            atom_pattn = re.compile(atom_regex)
-            pos = 0
-            while pos < len(line) :
-                mo = token_pattn.match(line, pos)
-                if mo :
-                    kind = mo.lastgroup
-                    value = mo.group()
-                    pos = mo.end()
-                    if kind == 'WHITE' or kind == 'NEWLINE' or kind == 'COMMENT' :
-                        continue
-                    elif kind == 'STRING' :
-                        yield T.STRING, value[1:-1]
-                    elif kind == 'ATOM' :
-                        am = atom_pattn.fullmatch(value)
-                        if am :
-                            kind = am.lastgroup
-                            if kind == 'INT' :
-                                yield T.INT, int(value)
-                            elif kind == 'FLOAT' :
-                                yield T.FLOAT, float(value)
-                            elif kind == 'BOOL' :
-                                yield T.BOOL, True if value == '#t' else False
-                            elif kind == 'KEYWORD' :
-                                yield T.KEYWORD, value
-                        else :
-                            yield T.SYMBOL, value
-                    else :      # QLP LP RP
-                        yield kind, value
-                else :
-                    raise SyntaxError('unknown token', line[pos:])
-        for k,v in tokenize(line) :
-            if k == 'LP' :
-                self.where[-1].append([])
-                self.where.append(self.where[-1][-1])
-            elif k == 'RP' :
-                if len(self.where) > 1 :
-                    self.where.pop()
+        where = self.where
+        for tok in _tokens(line) :
+            if tok == '(' :
+                where[-1].append([])
+                where.append(where[-1][-1])
+            elif tok == ')' :
+                if len(where) > 1 :
+                    where.pop()
                 else :
-                    raise SyntaxError('unexpect token', v)
+                    raise SyntaxError('unexpect token', tok)
+            elif tok == "'(" :
+                where[-1].append(ATOM('QLP', tok))
+            else :
+                where[-1].append(tok)
+
+# --- Image -----------------------------------------------------------------
+# 映像文件：魔数、key（源程序的散列，长度不限）、pickle保存的(全局环境, [Code, ...])。
+# 魔数里带着格式版本，指令集或值的表示改变时版本加一，旧的映像和.r0c缓存随之失效，同.pyc的做法。
+# 代码里的GLOBAL指令直接引用环境里的Cell，两者必须放在同一个pickle里，载入后引用关系才保持不变。
+import os
+import pickle
+import hashlib
+
+IMAGE_VERSION = 3
+IMAGE_MAGIC = b'R0I' + bytes([IMAGE_VERSION])
+
+def save_image(path, intp, codes=(), key=b'') :
+    """把解释器的全局环境和以它编译的代码写入映像文件，先写临时文件再改名。"""
+    data = pickle.dumps( (intp.env, list(codes)), pickle.HIGHEST_PROTOCOL )
+    with open(path+'.tmp', 'wb') as f :
+        f.write(IMAGE_MAGIC + len(key).to_bytes(2, 'little') + key)
+        f.write(data)
+    os.replace(path+'.tmp', path)
+
+def load_image(path, key=b'', **opts) :
+    """载入映像文件，返回(解释器, [Code, ...])；文件不存在、版本或key不符、内容无法还原时都返回None，当作缓存未命中。opts传给Interp0。"""
+    try :
+        with open(path, 'rb') as f :
+            head = f.read(len(IMAGE_MAGIC)+2)
+            if head[:len(IMAGE_MAGIC)] != IMAGE_MAGIC or f.read(int.from_bytes(head[-2:], 'little')) != key :
+                return None
+            env, codes = pickle.load(f)
+    except Exception :          # 损坏或由别的版本写出的pickle可能抛出各种异常
+        return None
+    return Interp0(env=env, **opts), codes
+
+def load_program(path, cache=True, **opts) :
+    """读入程序源文件并全部编译，返回(解释器, 各顶层表达式的Code)。
+       cache为真时编译结果连同全局环境存入源文件旁的__pycache__/<文件名>.r0c，源文件的散列不变就直接载入。"""
+    with open(path, 'rb') as f :
+        source = f.read()
+    key = hashlib.sha256(source).digest()
+    cachefile = os.path.join(os.path.dirname(path), '__pycache__', os.path.basename(path) + '.r0c')
+    loaded = load_image(cachefile, key, **opts) if cache else None
+    if loaded is not None :
+        return loaded
+    intp = Interp0(**opts)
+    codes = [ Interp0.compile(e, intp.env) for e in SxParser.fromStream([source.decode('utf-8')]) ]
+    if cache :
+        try :
+            os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+            save_image(cachefile, intp, codes, key)
+        except OSError :
+            pass                # 目录不可写时只是不缓存
+    return intp, codes
+
+# --- Server ----------------------------------------------------------------
+# 行分隔JSON的求值服务。每行一个请求：{"id":..., "session":"名字", "code":"R0程序", "steps":N, "timeout":秒}，
+# 或{"session":"名字", "close":true}关闭会话；每个请求回一行，带同样的id，完成的先回。
+# 每个会话有自己的Interp0和SxParser，code不完整时先缓存，回{"complete": false}，等后续请求补全。
+# 会话按名字的散列固定在一个单进程的工作池里，同一会话的请求依次执行，不同会话在多个进程里并发。
+import io
+import sys
+import json
+import zlib
+import asyncio
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+MAX_SESSIONS = 256      # 每个工作进程保留的会话个数，超出时关闭最久未用的
+SERVE_STEPS = 10**7     # 每个请求默认的步数上限
+SERVE_TIMEOUT = 10.0    # 每个请求默认的时间上限（秒）
+
+_sessions = OrderedDict()   # 工作进程里的会话：名字 -> (Interp0, SxParser)
+
+def serve_eval(session, source, steps=SERVE_STEPS, timeout=SERVE_TIMEOUT) :
+    """在工作进程里执行一个请求，返回可以转成JSON的dict：value是最后一个表达式的值，output是display的输出。
+
+    >>> serve_eval('doc', '(define (sq x) (* x x)) (display "hi")')
+    {'value': None, 'output': 'hi'}
+    >>> serve_eval('doc', '(sq')
+    {'complete': False}
+    >>> serve_eval('doc', '12)')
+    {'value': '144', 'output': ''}
+    >>> serve_eval('doc', '(define (spin) (spin)) (spin)', steps=100)
+    {'error': "RuntimeError: ('step limit exceeded', 100)", 'output': ''}
+    """
+    if session in _sessions :
+        _sessions.move_to_end(session)
+    else :
+        _sessions[session] = (Interp0(), SxParser())
+        if len(_sessions) > MAX_SESSIONS :
+            _sessions.popitem(last=False)
+    intp, parser = _sessions[session]
+    out = io.StringIO()
+    res = {}
+    try :
+        parser.feed(source + '\n')
+        if not parser.complete() :
+            return {'complete' : False}
+        intp.limit = Limit(steps, timeout)
+        v = None
+        with contextlib.redirect_stdout(out) :
+            for e in parser.done() :
+                v = intp.eval(e)
+        res['value'] = None if v is None else SxParser.toString(v)
+    except Exception as err :
+        parser.clear()
+        res['error'] = '%s: %s' % (type(err).__name__, err)
+    finally :
+        intp.limit = None
+    res['output'] = out.getvalue()
+    return res
+
+def serve_close(session) :
+    return {'closed' : _sessions.pop(session, None) is not None}
+
+class Server :
+    """求值服务，workers个单进程的工作池。serve()不给地址时读标准输入、写标准输出，
+       地址是'host:port'时监听TCP，否则是Unix socket的路径。"""
+    def __init__(self, workers=None) :
+        self.pools = [ ProcessPoolExecutor(1) for i in range(workers or os.cpu_count() or 1) ]
+        for pool in self.pools :    # 先启动工作进程，免得fork出的进程继承之后打开的连接，使连接关不掉
+            pool.submit(int).result()
+    def close(self) :
+        for pool in self.pools :
+            pool.shutdown(cancel_futures=True)
+
+    async def respond(self, line) :
+        try :
+            req = json.loads(line)
+            session = str(req.get('session', ''))
+            pool = self.pools[zlib.crc32(session.encode('utf-8')) % len(self.pools)]
+            loop = asyncio.get_running_loop()
+            if req.get('close') :
+                res = await loop.run_in_executor(pool, serve_close, session)
             else :
-                self.where[-1].append(ATOM(k,v))
+                timeout = float(req.get('timeout', SERVE_TIMEOUT))
+                job = loop.run_in_executor(pool, serve_eval, session, str(req.get('code', '')), req.get('steps', SERVE_STEPS), timeout)
+                try :       # 虚拟机到时会自己停下，这里只是后备
+                    res = await asyncio.wait_for(job, timeout + 1.0)
+                except asyncio.TimeoutError :
+                    res = {'error' : 'timeout'}
+            res['id'] = req.get('id')
+        except (ValueError, AttributeError) as err :
+            res = {'id' : None, 'error' : 'bad request: %s' % err}
+        return json.dumps(res, ensure_ascii=False) + '\n'
+
+    async def handle(self, readline, write) :
+        """逐行读请求，每个请求一个任务，回复按完成的顺序写出。"""
+        async def reply(line) :
+            write(await self.respond(line))
+        tasks = set()
+        while True :
+            line = await readline()
+            if not line :
+                break
+            if line.strip() :
+                task = asyncio.create_task(reply(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        if tasks :
+            await asyncio.gather(*tasks)
+
+    async def serve(self, address=None) :
+        if address is None :
+            loop = asyncio.get_running_loop()
+            def write(text) :
+                sys.stdout.write(text)
+                sys.stdout.flush()
+            await self.handle(lambda : loop.run_in_executor(None, sys.stdin.readline), write)
+            return
+        async def client(reader, writer) :
+            await self.handle(reader.readline, lambda text : writer.write(text.encode('utf-8')))
+            await writer.drain()
+            writer.close()
+        host, colon, port = address.rpartition(':')
+        if colon :
+            server = await asyncio.start_server(client, host or '127.0.0.1', int(port))
+        else :
+            server = await asyncio.start_unix_server(client, address)
+        async with server :
+            await server.serve_forever()
+
+def run_server() :
+    server = Server(args.workers)
+    try :
+        asyncio.run(server.serve(None if args.serve == '-' else args.serve))
+    except KeyboardInterrupt :
+        pass
+    finally :
+        server.close()
 
 # --- Main ------------------------------------------------------------------
 import argparse
 
 def run_progfile() :
-    intp = Interp0()
-    with open(args.progfile, encoding='utf-8') as f :
-        exps = SxParser.fromString(f.read())
-    for e in exps :
-        v = intp.eval(e)
-        if v != None : print(SxParser.toString(v))
+    opts = { 'profile' : args.profile or bool(args.folded) }
+    if args.cache :
+        intp, codes = load_program(args.progfile, **opts)
+        for code in codes :
+            v = intp.execute(code)
+            if v != None : print(SxParser.toString(v))
+    else :
+        intp = Interp0(**opts)
+        with open(args.progfile, encoding='utf-8') as f :
+            for e in SxParser.fromStream(f) :
+                v = intp.eval(e)
+                if v != None : print(SxParser.toString(v))
+    if intp.prof is not None :
+        if args.profile :
+            print(intp.prof.report(), file=sys.stderr)
+        if args.folded :
+            with open(args.folded, 'w', encoding='utf-8') as f :
+                intp.prof.write_folded(f)
+    return intp
 
 def run_interactive() :
     intp = Interp0()
@@ -310,12 +1280,28 @@ def run_interactive() :
 if __name__ == '__main__' :
     parser = argparse.ArgumentParser(description = '简单的解释器，实现类LISP语言R0。')
     parser.add_argument('progfile', nargs='?', help='程序源文件。')
+    parser.add_argument('-m', '--memstat', action='store_true', help='运行程序源文件时用tracemalloc统计内存，结束后报告当前和峰值占用，以及define-memo缓存的命中率。可重复比较的内存基准见benchmark.py -k r0rs.memory。')
+    parser.add_argument('-c', '--cache', action='store_true', help='把编译结果缓存在__pycache__里，源文件不变时直接载入。')
+    parser.add_argument('-p', '--profile', action='store_true', help='运行程序源文件时统计各函数的调用次数和累计时间，结束后报告。')
+    parser.add_argument('--folded', metavar='FILE', help='把折叠调用栈写入FILE，可交给flamegraph.pl生成火焰图。')
+    parser.add_argument('--serve', nargs='?', const='-', metavar='ADDR', help='作为求值服务运行，读写行分隔的JSON；ADDR是host:port或Unix socket路径，缺省用标准输入输出。')
+    parser.add_argument('--workers', type=int, help='求值服务的工作进程数，缺省为CPU个数。')
     args = parser.parse_args()
     #print(args)
     #ss = '  (/ ( + 3 5 ) ( * 7 -9 ) flash name ) define \n #t #f #tf #T #F lambda \n (+ "hello"123 123"world" "stri\ng") 3 "the end"'
     #print(*[ repr(e) for e in SxParser.fromString(ss) ], sep='\n')
     #exit()
-    if args.progfile :
+    if args.serve :
+        run_server()
+    elif args.progfile and args.memstat :
+        import tracemalloc
+        tracemalloc.start()
+        intp = run_progfile()
+        current, peak = tracemalloc.get_traced_memory()
+        print('memory: current %.1f KB, peak %.1f KB' % (current/1024, peak/1024), file=sys.stderr)
+        for st in intp.memo_stats() :
+            print('memo %(name)s: %(size)d/%(maxsize)d entries, %(hits)d hits, %(misses)d misses, hit rate %(hit_rate).2f' % st, file=sys.stderr)
+    elif args.progfile :
         run_progfile()
     else :
         run_interactive()